@@ -22,7 +22,8 @@
 ##############################################################################
 # Section 1: setting up your computer to run this program
 # This program is written in Python 2.6-2.7.
-# For a large speed boost, try installing PyPy 1.9 as a replacement.
+# For a large speed boost, install the Numba library if there is a version of 
+# it for your Python (see use_jit below).
 
 # Step 1: Install Python 2.7.3 from here: 
 # http://www.python.org/download/releases/2.7.3/
@@ -30,8 +31,15 @@
 # Windows installed, x86-64 if you have 64-bit Windows installed.)
 # I suggest using the default option, which will install Python to c:/Python27
 
-# Step 2: Copy this program into the c:/Python27 directory
-# You can also put it into any directory that is added to the correct PATH.
+# Step 2: Install the NumPy library from here: 
+# http://sourceforge.net/projects/numpy/files/NumPy/
+# Pick the "superpack" installer that matches your version of Python.
+
+# Step 3: Copy this program and the spatialpattern folder next to it into 
+# the c:/Python27 directory.
+# You can also put them into any directory that is added to the correct PATH.
+# The spatialpattern folder holds the analysis itself, which can also be 
+# used from other Python programs; see spatialpattern/__init__.py.
 
 ##############################################################################
 # Section 2: file preparation for this program (and related scripts)
@@ -43,7 +51,9 @@
 # layers, add layer information for each cell in column 4.  (Do a y-coordinate 
 # sort on the data, then fill in the column with reference to the Stereo 
 # Investigator file.)  Save, set your variables in the section below, and run 
-# the program.
+# the program.  A data set without layers does not need any preparation: the 
+# raw Stereo Investigator export (like NoLayer_B4925.txt) can be read as is, 
+# and its z column and any other extra columns are ignored.
 
 ##############################################################################
 # User set variables here
@@ -60,6 +70,42 @@ inputfile = r"B4925.txt"
 # This is the name of the .xls file that the program will save when finished. 
 outputfile = r"test_output.txt"
 
+# This is the name of a second file, saved next to outputfile, with the 
+# statistics of the simulations for each distance: the raw and simulated 
+# clustering values, the smallest and largest value any simulation gave, 
+# the quantiles of the simulations listed in sim_quantiles, and the 
+# p-values that the cells are more clustered (or more dispersed) than at 
+# random.  The p-values count how many simulations were at least as 
+# extreme as the real data, so they can be no smaller than 
+# 1 / (sim_run_num + 1).  The default quantiles give a 95% envelope.  The 
+# file is not saved with the analytic null model, which makes no 
+# simulations.
+statsfile = r"test_stats.txt"
+sim_quantiles = (0.025, 0.975)
+
+# To analyze many files at once, set batch_files to a file name pattern 
+# inside directory, such as r"B*.txt", and list the pairs of cell types to 
+# compare in batch_pairs.  Every matching file is analyzed for every pair; 
+# each file is only read once and all of its pairs are analyzed together, 
+# the files are shared out over sim_workers processes, and all of the 
+# results are saved together in batch_outputfile, one row per file and 
+# pair, with the seed its simulations used.  The statistics of the 
+# simulations of every file and pair, as in statsfile, are saved in 
+# batch_statsfile, one row per file, pair and statistic; set it to None to 
+# not save them.  Leave batch_files empty to analyze inputfile with 
+# celltype1 and celltype2 below.
+batch_files = r""
+batch_pairs = [(1, 1), (1, 3), (3, 3)]
+batch_outputfile = r"batch_output.txt"
+batch_statsfile = r"batch_stats.txt"
+
+# Set use_cache to True to save a binary copy of each data file's cells and 
+# layer boundaries the first time it is read, in a folder next to it named 
+# like B4925.txt.spcache.  Later runs on the same file, for example with 
+# different cell types or distances, then skip reading the text file.  The 
+# copy is remade automatically whenever the data file changes.
+use_cache = False
+
 # This variable adjusts the cell types that are being compared.  Input the 
 # values in the first column of your saved .txt file.  In the demo run, 
 # neuron = 1, microglia = 3.  To examine the spatial organization of a single 
@@ -79,6 +125,30 @@ layer_num = 6
 # be excluded from analysis to avoid edge effects
 exclude_dist = 100
 
+# For a 3-D analysis of thick sections, set use_z to True.  The z column of 
+# the raw Stereo Investigator export (column 4) is then kept, distances are 
+# measured in 3-D, and the positional null model spreads the cells through 
+# the depth of the section as well.  With layers, the layer column then 
+# goes after the z column.  z_exclude_dist sets the distance from the top 
+# and bottom faces of the section at which seed cells will be excluded; 
+# leave it at None to keep every depth, as suits sections thinner than the 
+# analysis range.  The analytic null model, edge_correction and 
+# histogram_dir cannot be used with use_z.
+use_z = False
+z_exclude_dist = None
+
+# Instead of excluding the cells near the ROI boundary, the clustering 
+# values can be edge-corrected.  With edge_correction = "translation", every 
+# cell is used as a seed cell and exclude_dist is ignored; each cell pair 
+# is weighted by how likely a pair that far apart is to be cut off by the 
+# ROI boundary (Ripley's translation correction), so pairs near the 
+# boundary count for more.  Using every cell makes the clustering values 
+# less noisy, which matters most on narrow ROIs, and so fewer simulations 
+# are needed.  The ROI has to be wider and taller than analysis_dist, and 
+# the analytic null model and histogram_dir cannot be used with it.  Set to 
+# None to exclude the cells near the boundary instead.
+edge_correction = None
+
 # This variable adjusts the studied distance and interval in the cleaned 
 # output file.  Do not exceed the excluded distance or you will have edge 
 # effects distorting your results!
@@ -96,238 +166,257 @@ interval_num = 100
 # in results.  1000 simulations may be ideal if you have the time/power.
 sim_run_num = 5
 
+# Instead of always making sim_run_num simulations, the program can stop as 
+# soon as the average is precise enough.  Set sim_tolerance to the largest 
+# relative standard error you will accept in any distance bin (0.01 means 
+# 1%); the simulations then stop once every bin is within it, after at 
+# least sim_min_runs runs and at most sim_run_num.  The shortest distances 
+# have the fewest cell pairs, and a bin whose average simulated clustering 
+# value (a count of cell pairs) is below 1 / (sim_tolerance ** 2 * 
+# sim_run_num) could not get within the tolerance even in sim_run_num runs, 
+# so those bins are left out of the test (if no bin is left in, all 
+# sim_run_num runs are made).  To choose that lower count yourself, set 
+# sim_tolerance_min_count to it; 0 tests every bin with simulated pairs.  
+# Leave sim_tolerance as None to always make sim_run_num runs.  Either way, 
+# the number of runs made, the largest relative standard error of the bins 
+# tested, and the bins left out are printed.
+sim_tolerance = None
+sim_tolerance_min_count = None
+sim_min_runs = 20
+
+# For long simulation runs, set checkpoint_dir to a folder name, such as 
+# r"C:\sp_checkpoints".  The progress of the simulations is then saved there 
+# every checkpoint_every runs.  If the program is stopped or the computer 
+# crashes, run it again with the same settings and it carries on from the 
+# last save, giving exactly the results it would have given had it not 
+# been interrupted.  sim_run_num, sim_tolerance and sim_workers can be 
+# changed before carrying on, for example to make more runs.  Once the 
+# simulations have finished, running the same settings again with 
+# random_seed None starts new simulations with a new number; with a fixed 
+# random_seed it gives the saved results straight away.  Leave 
+# checkpoint_dir as None to save nothing.
+checkpoint_dir = None
+checkpoint_every = 50
+
+# For sweeps over exclude_dist, analysis_dist and interval_num, set 
+# histogram_dir to a folder name, such as r"C:\sp_histograms".  The first 
+# analysis of each file and set of cell types then saves there how many 
+# cell pairs it found at each distance, for the real data and for every 
+# simulation.  Later analyses of the same file and cell types are worked 
+# out from these counts in seconds, without measuring any distances again, 
+# and give exactly the results a full analysis would.  This works for any 
+# analysis whose distance bins (interval_num / analysis_dist) are a whole 
+# number of the first analysis's bins wide, whose range is no longer, and 
+# whose exclude_dist is a whole number from the first analysis's up to 
+# histogram_max_exclude (None means only the first analysis's).  So make 
+# the first analysis the one with the finest bins, the longest range and 
+# the smallest exclude_dist, with interval_num no larger than 
+# analysis_dist.  Any other analysis starts the counts over, except one 
+# with interval_num larger than analysis_dist, which cannot start them and 
+# is run in full without them (a warning says so).  The saved 
+# counts take about 8 * (histogram_max_exclude - exclude_dist + 1) * 
+# (analysis_dist + 1) bytes for each ordered pair of cell types and each 
+# simulation.  Raising sim_run_num adds simulations to the saved ones.
+histogram_dir = None
+histogram_max_exclude = None
+
+# This variable sets how the expected (random) clustering values are found.  
+# "positional" runs the simulations described above.  "analytic" computes 
+# the value the simulations average out to directly from the cell counts and 
+# layer bands, which takes a fraction of a second.  It is exact when 
+# exclude_dist is at least analysis_dist; use it for quick screening runs, 
+# and the simulations for final figures.  "labels" is the random labelling 
+# null model: every cell stays where it is and the cell types of the two 
+# types compared are shuffled among their cells (within each layer when 
+# layers is True).  It asks whether the two types are arranged differently 
+# from each other, rather than from random locations, and since no cell 
+# moves, its simulations are much faster.  With a single cell type 
+# (celltype1 equal to celltype2) shuffling changes nothing, so the 
+# corrected clustering ratio is 1 everywhere.  Each pair of batch_pairs is 
+# shuffled among its own two types only, so its result is the same whatever 
+# other pairs are analyzed with it.
+null_model = "positional"
+
+# The number of processes to spread the simulation runs over.  Set to 1 to 
+# run everything on one core, or to 0 to use every core on the computer.
+sim_workers = 1
+
+# Each simulation run draws its random cell locations from its own seed, 
+# which is made from this number and the run number.  Set it to any whole 
+# number from 0 to 4294967295 to get exactly the same simulation results 
+# every time, however many workers are used.  Leave it as None to pick a new 
+# number for each run of the program; the number picked is printed so the 
+# run can be repeated.
+random_seed = None
+
+# The program times each stage of the analysis (reading the file, finding 
+# the ROI boundaries and layers, clustering the real data, generating and 
+# clustering the simulations, and saving the output) and counts the seed 
+# cells and cell pairs compared.  A summary is printed at the end, and the 
+# details are saved in timing_report, a JSON file, for comparing runs and 
+# sizing jobs.  Set timing_report to None to not save it.  Set profile_file 
+# to a file name to also save a Python profile of the run, which can be 
+# read with the pstats module; only the main process is profiled, so set 
+# sim_workers to 1 when profiling.
+timing_report = r"timing_report.json"
+profile_file = None
+
+# This variable selects the engine used to count cells around each seed 
+# cell.  "grid" sorts the cells into squares one analysis distance wide and 
+# only compares each seed cell with cells in its own and the 8 neighboring 
+# squares; it is the fastest choice for large sections.  "numpy" computes 
+# and bins the distances from a block of seed cells to every other cell at 
+# once.  "python" is the original cell-by-cell loop, kept as a reference.  
+# All three give identical clustering values.
+engine = "grid"
+
+# If the Numba library is installed, the "grid" engine (and the histograms 
+# of histogram_dir) count cell pairs with a compiled loop that runs on every 
+# core.  It gives identical clustering values, several times faster.  The 
+# first analysis after installing Numba takes a few seconds longer while 
+# the loop is compiled.  Without Numba, or with use_jit set to False, NumPy 
+# is used instead.
+use_jit = True
+
+# For whole-slide data sets too large to count all at once, set tile_size 
+# to a width in um, such as 2000.  The ROI is then split into square tiles 
+# that wide, and the cell pairs of each tile, with a border analysis_dist 
+# wide around it, are counted on their own and added up.  The clustering 
+# values are the same as without tiles (with edge_correction set, the 
+# weighted sums are added in a different order and may differ in the last 
+# digits), but only one tile's cells are worked on at a time; with 
+# use_cache set, the cells are read from the cache a piece at a time as 
+# well.  Tiles much smaller than analysis_dist spend most of their time on 
+# the borders.  Set to None to count the whole ROI at once.
+tile_size = None
+
 ##############################################################################
-# Program begins here
+# Program begins here.  The analysis itself is in the spatialpattern package 
+# next to this file; this program runs it with the settings above.
 
 # Import module to handle a tab-delimited text file
+import cProfile
 import csv
-import math
-import random
-import time
-
-
-def load_file():
-    """Load and cleanup file. Output is sp_data, which contains all cells. 
-    Output is [[celltype1, xcoord1, ycoord1],[celltype2, xcoord2, ycoord2], 
-    etc]"""
-    path = directory + "\\" + inputfile
-    myfileobj = open(path, "r") 
-    csv_read = csv.reader(myfileobj, dialect=csv.excel_tab)
-    sp_data = []
-    if layers:
-        for line in csv_read:
-            sp_data.append(line[0:4])
-    else:
-        for line in csv_read:
-            sp_data.append(line[0:3])
-        for cell in sp_data:
-            cell.append(1)
-    sp_data = sp_data[1:]
-    for cell in sp_data:
-        cell[0], cell[1] = int(cell[0]), float(cell[1]) 
-        cell[2], cell[3] = float(cell[2]), int(cell[3])
-    return sp_data
-
-
-def boundaries(sp_data):
-    """ This function finds the max and min x and y ROI boundaries in the data 
-    file. The data file is modified so that the distance of each cell from 
-    these boundaries is recorded in positions cell[4] - cell[7]."""
-    (xmin, ymin, xmax, ymax) = (sp_data[0][1], sp_data[0][2], 
-                                sp_data[0][1], sp_data[0][2])
-    for cell in sp_data:
-        if cell[1] < xmin:
-            xmin = cell[1]
-        if cell[1] > xmax:
-            xmax = cell[1]
-        if cell[2] < ymin:
-            ymin = cell[2]
-        if cell[2] > ymax:
-            ymax = cell[2]
-    for cell in sp_data:
-        xmin_dist = abs(cell[1] - xmin)
-        xmax_dist = abs(xmax - cell[1])
-        ymin_dist = abs(cell[2] - ymin)
-        ymax_dist = abs(ymax - cell[2])
-        cell.append(xmin_dist)
-        cell.append(xmax_dist)
-        cell.append(ymin_dist)
-        cell.append(ymax_dist)
-    return sp_data, xmin, xmax, ymin, ymax
-
-
-def layer_ybound(sp_data_mod, ymin, ymax):
-    """This function sets boundaries by layer so that when random cell 
-    location simulations are generated, they are performed by layer.  
-    This is necessary because cell density varies by layer."""
-    ybound_list = []
-    for layer in xrange(layer_num):
-        layer_list = []
-        for cell in sp_data_mod:
-            if cell[3] == layer + 1:
-                layer_list.append(cell[2])
-        layer_max = layer_list[0]
-        layer_min = layer_list[0]
-        for layer_cell in layer_list:
-            if layer_cell > layer_max:
-                layer_max = layer_cell
-            if layer_cell < layer_min:
-                layer_min = layer_cell
-        ybound_list.append([layer_max, layer_min, layer + 1])
-    # Set layer boundaries by averaging the min from one layer with the max 
-    # from the next layer.
-    for layer in xrange(layer_num - 1):
-        try:
-            layer_bound = (ybound_list[layer][1] + 
-                           ybound_list[layer + 1][0]) / 2
-            (ybound_list[layer][1], ybound_list[layer + 1][0]) = (layer_bound, 
-                                                                  layer_bound)
-            ybound_list[0][0], ybound_list[0][layer_num - 1] = ymax, ymin
-        except:
-            pass     
-    return ybound_list
-
-
-def cluster(sp_data, celltype1, celltype2):
-    """Generate clustering values.
-    This function is the main time sink of the program right now."""
-    print "cluster in: " + str(time.clock())
-    class1_cells = [cell for cell in sp_data if cell[0] == celltype1]
-    class2_cells = [cell for cell in sp_data if cell[0] == celltype2]
-    raw_cluster = [0.] * (analysis_dist)
-    analysis_dist_squared = analysis_dist ** 2
-    for cell1 in class1_cells:
-        if (cell1[4] > exclude_dist and cell1[5] > exclude_dist and 
-            cell1[6] > exclude_dist and cell1[7] > exclude_dist):
-            # Setting these variables here shaves ~7-8% off runtime
-            xloc = cell1[1]
-            yloc = cell1[2]
-            for cell2 in class2_cells:
-                dist_squared = (xloc - cell2[1]) ** 2 + (yloc - cell2[2]) ** 2
-                if 0 < dist_squared < analysis_dist_squared:
-                    dist = math.sqrt(dist_squared)
-                    array_target = int(math.ceil(dist * (analysis_dist - 1) / 
-                                                 interval_num))
-                    for insert in xrange(array_target, analysis_dist):
-                        raw_cluster[insert] += 1
-    print "cluster out: " + str(time.clock())
-    return raw_cluster
-
-
-def cluster_average(cluster1, cluster2):
-    """ Average together the results of the two runs (one from the 
-    "perspective" of each cell type)."""
-    for interval in xrange(analysis_dist):
-        cluster1[interval] = (float(cluster1[interval]) + 
-                              float(cluster2[interval]))/2
-    return cluster1
-
-
-def sim_gen(sp_data, xmin, xmax, ybound_list):
-    """Make a simulated version of the cell distribution with random 
-    locations"""
-    sim_data = []
-    if layers:
-        for cell in sp_data:
-            yrand = random.uniform(ybound_list[cell[3]-1][0], 
-                                   ybound_list[cell[3]-1][1])
-            sim_data.append([cell[0], random.uniform(xmin, xmax), yrand, 
-                              cell[3]])
+import glob
+import os
+
+import spatialpattern
+
+config = spatialpattern.Config(layers=layers, layer_num=layer_num, 
+                               use_z=use_z, exclude_dist=exclude_dist, 
+                               z_exclude_dist=z_exclude_dist, 
+                               edge_correction=edge_correction, 
+                               analysis_dist=analysis_dist, 
+                               interval_num=interval_num, 
+                               sim_run_num=sim_run_num, 
+                               sim_tolerance=sim_tolerance, 
+                               sim_tolerance_min_count= 
+                               sim_tolerance_min_count, 
+                               sim_min_runs=sim_min_runs, 
+                               sim_quantiles=sim_quantiles, 
+                               null_model=null_model, 
+                               sim_workers=sim_workers, 
+                               random_seed=random_seed, engine=engine, 
+                               use_jit=use_jit, tile_size=tile_size, 
+                               use_cache=use_cache, 
+                               checkpoint_dir=checkpoint_dir, 
+                               checkpoint_every=checkpoint_every, 
+                               histogram_dir=histogram_dir, 
+                               histogram_max_exclude=histogram_max_exclude)
+
+
+def print_job(job_result):
+    """Report a finished batch job."""
+    path, celltype1, celltype2, result = job_result
+    print "finished " + os.path.basename(path) + " " + str(celltype1) + \
+          " vs " + str(celltype2)
+    if result.seed is not None:
+        print "simulation seed: " + str(result.seed)
+
+
+def save_output(result):
+    """Print the results of a single analysis and save them in outputfile 
+    and statsfile."""
+    print "raw clustering value: "
+    print result.raw_cluster.tolist()
+    if result.seed is not None:
+        print "simulation seed: " + str(result.seed)
+    print "simulation clustering value:"
+    print result.sim_cluster.tolist()
+    if result.sim_runs is not None:
+        print "simulation runs: " + str(result.sim_runs)
+        tested = result.sim_tested
+        if tested.any():
+            print "largest relative standard error: " + \
+                  str(result.sim_error[tested].max())
+        left_out = [str(location) + " um" for location in xrange(config.bins) 
+                    if not tested[location]]
+        if left_out:
+            print "bins left out of the error test: " + ", ".join(left_out)
+    print "output clustering value: "
+    print result.sp_output.tolist()
+
+    dist_labels = []
+    for location in xrange(config.bins):
+        dist_labels.append(str(location) + " um")
+    out_path = directory + "\\" + outputfile
+    output_writer = csv.writer(open(out_path, 'w'), delimiter='\t', 
+                               quotechar='|', quoting=csv.QUOTE_MINIMAL)
+    output_writer.writerow(dist_labels)
+    output_writer.writerow(result.sp_output.tolist())
+
+    if result.sim_runs is not None:
+        stats_writer = csv.writer(open(directory + "\\" + statsfile, 'w'), 
+                                  delimiter='\t', quotechar='|', 
+                                  quoting=csv.QUOTE_MINIMAL)
+        stats_writer.writerow([""] + dist_labels)
+        for label, values in spatialpattern.stats_rows(result, config):
+            stats_writer.writerow([label] + values.tolist())
+
+
+def print_timings(timings):
+    """Print how long each stage of the analysis took, slowest first."""
+    stages = sorted(timings.stages.items(), 
+                    key=lambda stage: -stage[1]["seconds"])
+    for name, record in stages:
+        print "%s: %.3f s in %d calls" % (name, record["seconds"], 
+                                          record["calls"])
+
+
+# The analysis only runs when this file is run as a program, not when it is 
+# imported (for example by worker processes).
+if __name__ == "__main__":
+    timings = spatialpattern.Timings()
+    if profile_file:
+        profiler = cProfile.Profile()
+        profiler.enable()
+
+    if batch_files:
+        paths = sorted(glob.glob(os.path.join(directory, batch_files)))
+        job_results = spatialpattern.batch_run(paths, batch_pairs, config, 
+                                               timings=timings)
+        batch_stats_path = None
+        if batch_statsfile:
+            batch_stats_path = directory + "\\" + batch_statsfile
+        spatialpattern.write_batch_table(directory + "\\" + batch_outputfile, 
+                                         job_results, config, print_job, 
+                                         batch_stats_path)
+        data_files = paths
     else:
-        for cell in sp_data:
-            sim_data.append([cell[0], random.uniform(xmin, xmax), 
-                             random.uniform(ymin, ymax), cell[3]])
-    return sim_data
-
-
-def sim_boundaries(sim_data, xmin, xmax, ymin, ymax):
-    """Modified version of boundaries function so as not to reset boundaries 
-    smaller in simulation runs"""
-    for cell in sim_data:
-        xmin_dist = abs(cell[1] - xmin)
-        xmax_dist = abs(xmax - cell[1])
-        ymin_dist = abs(cell[2] - ymin)
-        ymax_dist = abs(ymax - cell[2])
-        cell.append(xmin_dist)
-        cell.append(xmax_dist)
-        cell.append(ymin_dist)
-        cell.append(ymax_dist)
-    return sim_data
-
-
-def sim_iterate(sim_run_num, sp_data_mod, celltype1, celltype2, xmin, xmax, 
-                ymin, ymax, ybound_list):
-    """This is the main function that runs simulations of cellular location"""
-    sim_track = [0.] * (analysis_dist) 
-    for runcount in xrange(sim_run_num):
-        print "simulation run " + str(runcount + 1)
-        sim_raw = sim_boundaries(sim_gen(sp_data_mod, xmin, xmax, 
-                                         ybound_list), xmin, xmax, 
-                                                       ymin, ymax)
-        if celltype1 == celltype2:
-            sim_cluster = cluster(sim_raw, celltype1, celltype1)
-        else:
-            sim_cluster = cluster_average(cluster(sim_raw, celltype1, 
-                                                  celltype2), 
-                                          cluster(sim_raw, celltype2, 
-                                                  celltype1))
-
-        for location in xrange(analysis_dist):
-            sim_track[location] = (sim_track[location] + 
-                                       sim_cluster[location])
-    for location in xrange(analysis_dist):
-        sim_track[location] = sim_track[location] / sim_run_num
-    return sim_track
-
-
-def sim_correct(raw_cluster, sim_cluster):
-    """Use simulation output to density-correct clustering data"""
-    corrected_output = [0.] * (analysis_dist)
-    for location in xrange(analysis_dist):
-        try:
-            corrected_output[location] = (raw_cluster[location] / 
-                                          sim_cluster[location])
-        except:
-            pass
-    return corrected_output
-
-
-print time.clock()
-# Add an extra column to analysis distance so program runs from zero to 
-# analysis distance, *inclusive*.
-analysis_dist += 1 
-
-sp_data = load_file()
-sp_data_mod, xmin, xmax, ymin, ymax = boundaries(sp_data)
-
-if celltype1 == celltype2:
-    raw_cluster = cluster(sp_data_mod, celltype1, celltype1)
-else:
-    raw_cluster = cluster_average(cluster(sp_data_mod, celltype1, celltype2), 
-                                  cluster(sp_data_mod, celltype2, celltype1))
-print "raw clustering value: "
-print raw_cluster
-
-if layers:
-    ybound_list = layer_ybound(sp_data_mod, ymin, ymax)
-else:
-    ybound_list = []
-sim_cluster = sim_iterate(sim_run_num, sp_data_mod, celltype1, celltype2, 
-                          xmin, xmax, ymin, ymax, ybound_list)
-print "simulation clustering value:"
-print sim_cluster
-
-sp_output = sim_correct(raw_cluster, sim_cluster)
-print "output clustering value: "
-print sp_output
-
-print "run time: " + str(time.clock())
-
-dist_labels = []
-for location in xrange(analysis_dist):
-    dist_labels.append(str(location) + " um")
-out_path = directory + "\\" + outputfile
-output_writer = csv.writer(open(out_path, 'w'), delimiter='\t', quotechar='|',
-                           quoting=csv.QUOTE_MINIMAL)
-output_writer.writerow(dist_labels)
-output_writer.writerow(sp_output)
\ No newline at end of file
+        prepared = spatialpattern.prepare_file(directory + "\\" + inputfile, 
+                                               config, timings)
+        result = spatialpattern.analyze_prepared(prepared, celltype1, 
+                                                 celltype2, config, 
+                                                 timings=timings)
+        with timings.stage("output"):
+            save_output(result)
+        data_files = [directory + "\\" + inputfile]
+
+    if profile_file:
+        profiler.disable()
+        profiler.dump_stats(directory + "\\" + profile_file)
+    print_timings(timings)
+    if timing_report:
+        timings.save(directory + "\\" + timing_report, config, 
+                     data_files=data_files)
+    print "run time: " + str(timings.report()["wall_seconds"])
@@ -169,57 +169,84 @@ def boundaries(sp_data):
 def layer_ybound(sp_data_mod, ymin, ymax):
     """This function sets boundaries by layer so that when random cell 
     location simulations are generated, they are performed by layer.  
-    This is necessary because cell density varies by layer."""
-    ybound_list = []
-    for layer in xrange(layer_num):
-        layer_list = []
-        for cell in sp_data_mod:
-            if cell[3] == layer + 1:
-                layer_list.append(cell[2])
-        layer_max = layer_list[0]
-        layer_min = layer_list[0]
-        for layer_cell in layer_list:
-            if layer_cell > layer_max:
-                layer_max = layer_cell
-            if layer_cell < layer_min:
-                layer_min = layer_cell
-        ybound_list.append([layer_max, layer_min, layer + 1])
+    This is necessary because cell density varies by layer.  The highest 
+    and lowest cell of every layer are found in one pass over the cells.  A 
+    ValueError names any layer with no cells, or any layer number outside 
+    1 to layer_num."""
+    layer_extents = {}
+    for cell in sp_data_mod:
+        extent = layer_extents.get(cell[3])
+        if extent is None:
+            layer_extents[cell[3]] = [cell[2], cell[2]]
+        elif cell[2] > extent[0]:
+            extent[0] = cell[2]
+        elif cell[2] < extent[1]:
+            extent[1] = cell[2]
+    outside = [str(layer) for layer in sorted(layer_extents) 
+               if not 1 <= layer <= layer_num]
+    if outside:
+        raise ValueError("Cells are marked as layer " + ", ".join(outside) + 
+                         ", but layer_num is " + str(layer_num))
+    empty = [str(layer) for layer in xrange(1, layer_num + 1) 
+             if layer not in layer_extents]
+    if empty:
+        raise ValueError("No cells are marked as layer " + ", ".join(empty) + 
+                         "; check layer_num and the layer column of the data")
+    ybound_list = [layer_extents[layer] + [layer] 
+                   for layer in xrange(1, layer_num + 1)]
     # Set layer boundaries by averaging the min from one layer with the max 
     # from the next layer.
     for layer in xrange(layer_num - 1):
-        try:
-            layer_bound = (ybound_list[layer][1] + 
-                           ybound_list[layer + 1][0]) / 2
-            (ybound_list[layer][1], ybound_list[layer + 1][0]) = (layer_bound, 
-                                                                  layer_bound)
-            ybound_list[0][0], ybound_list[0][layer_num - 1] = ymax, ymin
-        except:
-            pass     
+        layer_bound = (ybound_list[layer][1] + ybound_list[layer + 1][0]) / 2
+        (ybound_list[layer][1], ybound_list[layer + 1][0]) = (layer_bound, 
+                                                              layer_bound)
+    ybound_list[0][0], ybound_list[layer_num - 1][1] = ymax, ymin
     return ybound_list
 
 
-def cluster(sp_data, celltype1, celltype2):
-    """Generate clustering values.
-    This function is the main time sink of the program right now."""
-    print "cluster in: " + str(time.clock())
-    sp_dict = defaultdict(list)
+def grid_index(sp_data):
+    """Sort the cells into a grid of squares analysis_dist wide, keyed by 
+    (cell type, column, row).  Every cell within analysis range of a seed 
+    cell is then in the seed's own square or one of the 8 around it.  Build 
+    this once per real or simulated data set; it also serves as the by-type 
+    grouping of the cells, so cluster does not regroup them on every 
+    call."""
+    grid = defaultdict(list)
     for cell in sp_data:
-        sp_dict[cell[0]].append(cell[0:8])
+        grid[(cell[0], int(math.floor(cell[1] / analysis_dist)), 
+              int(math.floor(cell[2] / analysis_dist)))].append(cell)
+    return grid
+
+
+def cluster(sp_data, celltype1, celltype2, grid):
+    """Generate clustering values.  grid is the output of grid_index for 
+    sp_data; each seed cell is only compared with the class2 cells in the 
+    3 x 3 block of grid squares around it."""
     raw_cluster = [0.] * (analysis_dist)
-    for cell1 in sp_dict[celltype1]:
-        if (cell1[4] > exclude_dist and cell1[5] > exclude_dist and 
-            cell1[6] > exclude_dist and cell1[7] > exclude_dist):
+    # The grid already groups the cells by type, so the seed cells are taken 
+    # from it one square at a time.
+    for (celltype, col, row), square_cells in grid.items():
+        if celltype != celltype1:
+            continue
+        neighbors = []
+        for square in [(celltype2, col + i, row + j) 
+                       for i in (-1, 0, 1) for j in (-1, 0, 1)]:
+            if square in grid:
+                neighbors.extend(grid[square])
+        for cell1 in square_cells:
+            if not (cell1[4] > exclude_dist and cell1[5] > exclude_dist and 
+                    cell1[6] > exclude_dist and cell1[7] > exclude_dist):
+                continue
             # Setting these variables here shaves ~7-8% off runtime
             xloc = cell1[1]
             yloc = cell1[2]
-            for cell2 in sp_dict[celltype2]:
+            for cell2 in neighbors:
                 dist = math.sqrt((xloc - cell2[1])**2 + (yloc - cell2[2])**2)
                 if dist > 0 and dist < analysis_dist:
                     array_target = int(math.ceil(dist * (analysis_dist - 1) / 
                                                  interval_num))
                     for insert in range (array_target, analysis_dist):
                         raw_cluster[insert] += 1
-    print "cluster out: " + str(time.clock())
     return raw_cluster
 
 
@@ -272,11 +299,14 @@ def sim_iterate(sim_run_num, sp_data_mod, celltype1, celltype2, xmin, xmax,
         sim_raw = sim_boundaries(sim_gen(sp_data_mod, xmin, xmax, 
                                          ybound_list), xmin, xmax, 
                                                        ymin, ymax)
+        sim_grid = grid_index(sim_raw)
         if celltype1 == celltype2:
-            sim_cluster = cluster(sim_raw, celltype1, celltype1)
+            sim_cluster = cluster(sim_raw, celltype1, celltype1, sim_grid)
         else:
-            sim_cluster = cluster_average(cluster(sim_raw, celltype1, celltype2), 
-                                          cluster(sim_raw, celltype2, celltype1))
+            sim_cluster = cluster_average(cluster(sim_raw, celltype1, 
+                                                  celltype2, sim_grid), 
+                                          cluster(sim_raw, celltype2, 
+                                                  celltype1, sim_grid))
 
         for location in xrange(analysis_dist):
             sim_track[location] = (sim_track[location] + 
@@ -298,46 +328,54 @@ def sim_correct(raw_cluster, sim_cluster):
     return corrected_output
 
 
-print time.clock()
-# Add an extra column to analysis distance so program runs from zero to 
-# analysis distance, *inclusive*.
-analysis_dist += 1 
-
-sp_data = loadfile()
-sp_data_mod, xmin, xmax, ymin, ymax = boundaries(sp_data)
-
-if celltype1 == celltype2:
-    raw_cluster = cluster(sp_data_mod, celltype1, celltype1)
-else:
-    raw_cluster = cluster_average(cluster(sp_data_mod, celltype1, celltype2), 
-                                  cluster(sp_data_mod, celltype2, celltype1))
-print "raw clustering value: "
-print raw_cluster
-
-if layers:
-    ybound_list = layer_ybound(sp_data_mod, ymin, ymax)
-else:
-    ybound_list = []
-sim_cluster = sim_iterate(sim_run_num, sp_data_mod, celltype1, celltype2, 
-                          xmin, xmax, ymin, ymax, ybound_list)
-print "simulation clustering value:"
-print sim_cluster
-
-sp_output = sim_correct(raw_cluster, sim_cluster)
-print "output clustering value: "
-print sp_output
-
-print "run time: " + str(time.clock())
-
-# Set up worksheet to write results to
-book = xlwt.Workbook(encoding="utf-8")
-sheet1 = book.add_sheet("Python Sheet 1")
-
-# Populate excel worksheet with headers and results
-for location in xrange(analysis_dist):
-    sheet1.write(0, location, (str(location) + " um"))
-    sheet1.write(1, location, sp_output[location])
-
-# Save the spreadsheet
-savepath = directory + "\\" + outputfile + ".xls"
-book.save(savepath)
+# The analysis only runs when this file is run as a program, so importing it 
+# does no work.  The functions above read the user set variables of this 
+# file; for an importable version of the analysis that takes its settings 
+# as arguments, see the spatialpattern package.
+if __name__ == "__main__":
+    print time.clock()
+    # Add an extra column to analysis distance so program runs from zero to 
+    # analysis distance, *inclusive*.
+    analysis_dist += 1 
+
+    sp_data = loadfile()
+    sp_data_mod, xmin, xmax, ymin, ymax = boundaries(sp_data)
+    grid = grid_index(sp_data_mod)
+
+    if celltype1 == celltype2:
+        raw_cluster = cluster(sp_data_mod, celltype1, celltype1, grid)
+    else:
+        raw_cluster = cluster_average(cluster(sp_data_mod, celltype1, 
+                                              celltype2, grid), 
+                                      cluster(sp_data_mod, celltype2, 
+                                              celltype1, grid))
+    print "raw clustering value: "
+    print raw_cluster
+
+    if layers:
+        ybound_list = layer_ybound(sp_data_mod, ymin, ymax)
+    else:
+        ybound_list = []
+    sim_cluster = sim_iterate(sim_run_num, sp_data_mod, celltype1, celltype2, 
+                              xmin, xmax, ymin, ymax, ybound_list)
+    print "simulation clustering value:"
+    print sim_cluster
+
+    sp_output = sim_correct(raw_cluster, sim_cluster)
+    print "output clustering value: "
+    print sp_output
+
+    print "run time: " + str(time.clock())
+
+    # Set up worksheet to write results to
+    book = xlwt.Workbook(encoding="utf-8")
+    sheet1 = book.add_sheet("Python Sheet 1")
+
+    # Populate excel worksheet with headers and results
+    for location in xrange(analysis_dist):
+        sheet1.write(0, location, (str(location) + " um"))
+        sheet1.write(1, location, sp_output[location])
+
+    # Save the spreadsheet
+    savepath = directory + "\\" + outputfile + ".xls"
+    book.save(savepath)
@@ -0,0 +1,356 @@
+"""Benchmarks of the clustering engines and null models on synthetic cell 
+fields.  Run it from the folder holding SpatialPatternAnalysis.py:
+
+    python benchmarks/bench.py
+    python benchmarks/bench.py --sizes 1000 10000 --runs 10
+
+Every case builds a synthetic field of cells, with or without layers, and 
+runs the full analysis of the chosen cell type pairs on it.  The real 
+clustering pass is reported in cell pairs per second, counting every seed 
+cell against every cell of the other type whether an engine measures the 
+pair or skips it, so that engines can be compared; the pair distances 
+each engine did measure are reported on their own.  The simulations are 
+reported in runs per second, along with the peak memory of the process 
+that ran the case.  Each case runs in a fresh process, so that the peak 
+memory is its own.  Before timing, every engine's results are checked 
+against the "python" reference engine on a small field, and analyses run 
+from several threads at once, and then with worker processes, are checked 
+against one run alone.  When Numba is 
+installed, the "grid" cases use its compiled kernel and are named 
+"grid-numba".
+
+The results are saved as a tab-delimited table in bench_output.txt and 
+compared with benchmarks/baseline.txt, a table saved earlier with 
+--save-baseline.  Cases more than --tolerance slower than the baseline are 
+reported as regressions.  Baselines are only comparable on the same 
+computer.
+"""
+from __future__ import absolute_import, division, print_function
+
+import argparse
+import csv
+import os
+import sys
+import threading
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(
+    __file__))))
+
+import spatialpattern  # noqa: E402
+import spatialpattern.engines  # noqa: E402
+import spatialpattern.kernels  # noqa: E402
+import spatialpattern.shared  # noqa: E402
+
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 
+                        "baseline.txt")
+
+COLUMNS = ("case", "cells", "layered", "engine", "null_model", 
+           "cluster_seconds", "pairs_per_second", "measured_pairs", 
+           "sim_seconds", 
+           "runs_per_second", "peak_mb")
+
+# Engines that compare every seed with every cell get slow quickly, so they
+# are only run up to these sizes unless asked otherwise.
+ENGINE_MAX_CELLS = {"python": 10 ** 3, "numpy": 10 ** 4, "grid": None}
+
+
+def parse_mix(text):
+    """Cell type mix from text like "1:0.6,3:0.4".  Output is the cell 
+    types and the fraction of cells of each."""
+    types, fractions = [], []
+    for item in text.split(","):
+        celltype, fraction = item.split(":")
+        types.append(int(celltype))
+        fractions.append(float(fraction))
+    fractions = np.array(fractions)
+    return types, fractions / fractions.sum()
+
+
+def synthetic_field(cells, layered, mix, density=1 / 2000., layer_num=6, 
+                    seed=0):
+    """Make a CellTable of randomly placed cells.  The field is twice as 
+    high as it is wide, with density cells per square um and cell types 
+    drawn from mix (see parse_mix).  With layered, the field is cut into 
+    layer_num horizontal bands of random height, numbered 1 from the top, 
+    and each band's cells are clumped towards its middle so that the 
+    layers differ in density."""
+    rng = np.random.RandomState(seed)
+    types, fractions = mix
+    width = np.sqrt(cells / density / 2)
+    height = 2 * width
+    x = rng.uniform(0, width, cells)
+    celltype = rng.choice(types, cells, p=fractions)
+    if not layered:
+        y = rng.uniform(0, height, cells)
+        return spatialpattern.CellTable(celltype, x, y, np.ones(cells))
+    edges = np.r_[0, np.sort(rng.uniform(0, height, layer_num - 1)), height]
+    layer = rng.randint(1, layer_num + 1, cells)
+    top, bottom = edges[::-1][layer - 1], edges[::-1][layer]
+    y = bottom + (top - bottom) * rng.beta(2, 2, cells)
+    return spatialpattern.CellTable(celltype, x, y, layer)
+
+
+def peak_mb():
+    """Peak resident memory of this process in MB, or None where the 
+    resource module is missing (Windows)."""
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in kB elsewhere
+    return peak / 2 ** 20 if sys.platform == "darwin" else peak / 2 ** 10
+
+
+def all_pairs(sp_data, pairs):
+    """Number of (seed cell, cell) pairs the clustering of every cell type 
+    pair in pairs covers: each seed cell of one type against every cell of 
+    the other, in both directions when the types differ."""
+    total = 0
+    for celltype1, celltype2 in pairs:
+        for seed_type, other_type in set([(celltype1, celltype2), 
+                                          (celltype2, celltype1)]):
+            total += (int(np.sum(sp_data.seed[sp_data.type == seed_type])) * 
+                      int(np.sum(sp_data.type == other_type)))
+    return total
+
+
+def run_case(case):
+    """Run one benchmark case in this process.  case is a dict with the 
+    case settings; output is a dict with a value for each of COLUMNS."""
+    sp_data = synthetic_field(case["cells"], case["layered"], case["mix"], 
+                              layer_num=case["layer_num"])
+    config = spatialpattern.Config(
+        layers=case["layered"], layer_num=case["layer_num"], 
+        analysis_dist=case["radius"], interval_num=case["radius"], 
+        exclude_dist=case["radius"], sim_run_num=case["runs"], 
+        null_model=case["null_model"], engine=case["engine"], random_seed=1, 
+        sim_quantiles=())
+    timings = spatialpattern.Timings()
+    prepared = spatialpattern.prepare(sp_data, config, timings=timings)
+    # Load (or compile) the kernel before timing
+    spatialpattern.engines.cluster_pairs(prepared.sp_data_mod, case["pairs"], 
+                                         config)
+    spatialpattern.analyze_pairs(prepared, case["pairs"], config, workers=1, 
+                                 timings=timings)
+    cluster = timings.stages["cluster"]
+    if case["null_model"] == "analytic":
+        sim_seconds = timings.stages["analytic"]["seconds"]
+    else:
+        sim_seconds = timings.stages["simulations"]["seconds"]
+    result = dict((name, case[name])
+                  for name in ("case", "cells", "layered", "engine", 
+                               "null_model"))
+    result.update(
+        cluster_seconds=cluster["seconds"], 
+        pairs_per_second=(all_pairs(prepared.sp_data_mod, case["pairs"]) / 
+                          max(cluster["seconds"], 1e-9)), 
+        measured_pairs=cluster["counts"].get("pair distances", 0), 
+        sim_seconds=sim_seconds, 
+        runs_per_second=(case["runs"] / max(sim_seconds, 1e-9)
+                         if case["null_model"] != "analytic" else None), 
+        peak_mb=peak_mb())
+    return result
+
+
+def check_identity(mix, pairs, engines, radius):
+    """Check that every engine gives exactly the clustering values of the 
+    "python" reference engine, for the real data and 2 simulation runs, on 
+    small fields with and without layers.  When Numba is installed, the 
+    "grid" engine is checked both with and without its compiled kernel.  
+    Output is a dict of engine: True or False."""
+    variants = [("python", "python", False)]
+    for engine in engines:
+        if engine == "grid" and spatialpattern.kernels.AVAILABLE:
+            variants.append(("grid (numba)", "grid", True))
+        if engine != "python":
+            variants.append((engine, engine, False))
+    identical = {}
+    for layered in (False, True):
+        prepared = None
+        results = {}
+        for name, engine, use_jit in variants:
+            config = spatialpattern.Config(
+                layers=layered, analysis_dist=radius, interval_num=radius, 
+                exclude_dist=radius, sim_run_num=2, engine=engine, 
+                use_jit=use_jit, random_seed=1, sim_quantiles=())
+            if prepared is None:
+                prepared = spatialpattern.prepare(
+                    synthetic_field(1000, layered, mix, seed=7), config)
+            results[name] = np.array([
+                (result.raw_cluster, result.sim_cluster)
+                for result in spatialpattern.analyze_pairs(prepared, pairs, 
+                                                           config)])
+            identical[name] = identical.get(name, True) and bool(
+                np.array_equal(results[name], results["python"]))
+    return identical
+
+
+def check_concurrency(mix, pairs, radius, threads=4):
+    """Check that analyses run from threads threads at once, as a program 
+    using the package may do, give exactly the clustering values of one 
+    analysis run alone, and then that an analysis using 2 worker processes 
+    does too.  With Numba installed, the threads share the compiled kernel 
+    and the workers are started after it has run, which are the cases that 
+    once aborted or hung.  Output is True or False."""
+    config = spatialpattern.Config(
+        analysis_dist=radius, interval_num=radius, exclude_dist=radius, 
+        sim_run_num=4, random_seed=1, sim_quantiles=())
+    prepared = spatialpattern.prepare(synthetic_field(5000, True, mix, 
+                                                      seed=11), config)
+
+    def values(workers=1):
+        return np.array([
+            (result.raw_cluster, result.sim_cluster)
+            for result in spatialpattern.analyze_pairs(prepared, pairs, 
+                                                       config, workers)])
+
+    expected = values()
+    results = [None] * threads
+
+    def run(number):
+        results[number] = values()
+
+    workers = [threading.Thread(target=run, args=(number,)) 
+               for number in range(threads)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    return bool(all(result is not None and np.array_equal(result, expected) 
+                    for result in results) and 
+                np.array_equal(values(workers=2), expected))
+
+
+def read_table(path):
+    """Read a table saved by write_table.  Output is a dict of case name: 
+    row dict, or an empty dict if there is no table."""
+    if not os.path.exists(path):
+        return {}
+    with open(path) as table_file:
+        return dict((row["case"], row)
+                    for row in csv.DictReader(table_file, delimiter="\t"))
+
+
+def write_table(path, results):
+    """Save the results of the cases as a tab-delimited table."""
+    with open(path, "w") as table_file:
+        writer = csv.writer(table_file, delimiter="\t")
+        writer.writerow(COLUMNS)
+        for result in results:
+            writer.writerow(["" if result[name] is None else result[name]
+                             for name in COLUMNS])
+
+
+def compare(results, baseline, tolerance):
+    """Compare the throughput of each case with the baseline.  Output is a 
+    list of (case, measure, ratio) for each measure; a ratio below 
+    1 - tolerance is a regression."""
+    comparisons = []
+    for result in results:
+        old = baseline.get(result["case"])
+        if old is None:
+            continue
+        for measure in ("pairs_per_second", "runs_per_second"):
+            if result[measure] is None or not old[measure]:
+                continue
+            old_value = float(old[measure])
+            if old_value > 0:
+                comparisons.append((result["case"], measure, 
+                                    result[measure] / old_value))
+    return comparisons
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--sizes", type=int, nargs="+", 
+                        default=[10 ** 3, 10 ** 4, 10 ** 5, 10 ** 6], 
+                        help="numbers of cells in the fields")
+    parser.add_argument("--engines", nargs="+", 
+                        default=["python", "numpy", "grid"])
+    parser.add_argument("--mix", default="1:0.6,2:0.15,3:0.25", 
+                        help="cell type mix, as type:fraction,...")
+    parser.add_argument("--pairs", default="1-3,1-1,3-3", 
+                        help="cell type pairs to analyze, as a-b,...")
+    parser.add_argument("--radius", type=int, default=100, 
+                        help="analysis_dist, interval_num and exclude_dist")
+    parser.add_argument("--runs", type=int, default=5, 
+                        help="simulation runs per case")
+    parser.add_argument("--layer-num", type=int, default=6)
+    parser.add_argument("--all-engines", action="store_true", 
+                        help="run every engine at every size")
+    parser.add_argument("--output", default="bench_output.txt")
+    parser.add_argument("--baseline", default=BASELINE)
+    parser.add_argument("--save-baseline", action="store_true", 
+                        help="save the results as the new baseline")
+    parser.add_argument("--tolerance", type=float, default=0.2, 
+                        help="slowdown allowed before a regression is "
+                             "reported")
+    args = parser.parse_args()
+    mix = parse_mix(args.mix)
+    pairs = [tuple(int(celltype) for celltype in pair.split("-"))
+             for pair in args.pairs.split(",")]
+
+    identical = check_identity(mix, pairs, args.engines, args.radius)
+    for engine in sorted(identical):
+        print("%s engine matches the reference: %s" % (engine, 
+                                                       identical[engine]))
+    concurrent = check_concurrency(mix, pairs, args.radius)
+    print("threads and worker processes match one analysis: %s" % 
+          concurrent)
+
+    cases = []
+    for cells in args.sizes:
+        for layered in (False, True):
+            settings = [(engine, "positional") for engine in args.engines
+                        if args.all_engines or 
+                        ENGINE_MAX_CELLS[engine] is None or 
+                        cells <= ENGINE_MAX_CELLS[engine]]
+            settings += [("grid", "labels"), ("grid", "analytic")]
+            for engine, null_model in settings:
+                label = engine
+                if engine == "grid" and spatialpattern.kernels.AVAILABLE:
+                    label = "grid-numba"
+                name = "%d %s %s %s" % (cells, 
+                                        "layered" if layered else "flat", 
+                                        label, null_model)
+                cases.append({"case": name, "cells": cells, 
+                              "layered": layered, "engine": engine, 
+                              "null_model": null_model, "mix": mix, 
+                              "pairs": pairs, "radius": args.radius, 
+                              "runs": args.runs, 
+                              "layer_num": args.layer_num})
+    # A new process for every case, so each peak memory is the case's own
+    pool = spatialpattern.shared.worker_pool(1, maxtasksperchild=1)
+    results = []
+    try:
+        for result in pool.imap(run_case, cases):
+            results.append(result)
+            print("%-32s %10.0f pairs/s %10s runs/s %8s MB" % (
+                result["case"], result["pairs_per_second"], 
+                "-" if result["runs_per_second"] is None else
+                "%.2f" % result["runs_per_second"], 
+                "-" if result["peak_mb"] is None else
+                "%.0f" % result["peak_mb"]))
+    finally:
+        pool.terminate()
+        pool.join()
+    write_table(args.output, results)
+
+    regressions = 0
+    for case, measure, ratio in compare(results, read_table(args.baseline), 
+                                        args.tolerance):
+        slow = ratio < 1 - args.tolerance
+        regressions += slow
+        print("%-32s %-17s %5.2fx baseline%s" % (
+            case, measure, ratio, "  REGRESSION" if slow else ""))
+    if args.save_baseline:
+        write_table(args.baseline, results)
+    if regressions or not all(identical.values()) or not concurrent:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
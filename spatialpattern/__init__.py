@@ -0,0 +1,25 @@
+"""Spatial pattern analysis of cell populations (Morgan et al., 2012).
+
+Importing this package does no work.  A typical use is:
+
+    import spatialpattern
+    config = spatialpattern.Config(layers=True, layer_num=6)
+    cells = spatialpattern.load_file("B4925.txt", config.layers)
+    result = spatialpattern.analyze(cells, 1, 3, config)
+
+result.sp_output then holds the corrected clustering ratio for each 
+distance bin.  Programs that run the simulations on worker processes 
+(Config.sim_workers) should keep their work under 
+`if __name__ == "__main__":`, as workers may be started afresh and import 
+the program (see shared.worker_pool).  SpatialPatternAnalysis.py is the 
+program that runs this on the files set in its user variables.
+"""
+from spatialpattern.analysis import (AnalysisResult, Prepared, analyze, 
+                                     analyze_pairs, analyze_prepared, prepare, 
+                                     prepare_file, sim_correct, stats_rows)
+from spatialpattern.batch import batch_run, write_batch_table
+from spatialpattern.cache import load_cached
+from spatialpattern.cells import CellTable, load_file
+from spatialpattern.config import Config
+from spatialpattern.stats import SimStats
+from spatialpattern.timing import Timings
@@ -0,0 +1,222 @@
+"""The full analysis of cell type pairs: raw clustering values, the null 
+model, and the corrected clustering ratio."""
+from __future__ import absolute_import, division
+
+from collections import namedtuple
+
+import numpy as np
+
+from spatialpattern.analytic import sim_analytic
+from spatialpattern.cache import load_cached
+from spatialpattern.cells import boundaries, layer_ybound, load_file
+from spatialpattern.checkpoint import checkpoint_path, load_checkpoint
+from spatialpattern.config import Config
+from spatialpattern.engines import cluster_pairs
+from spatialpattern.histogram import open_histograms, save_histograms
+from spatialpattern.simulate import new_seed, sim_iterate_pairs
+from spatialpattern.timing import Timings
+
+# raw_cluster, sim_cluster and sp_output are arrays with one value per 
+# distance bin; seed is the base seed the simulations used, sim_runs the 
+# number of simulation runs made, sim_error the relative standard error of 
+# sim_cluster (and so of sp_output) in each bin, and sim_tested a mask of 
+# the bins the early stopping test used (see SimStats.tested_bins).  
+# sim_envelope holds the smallest and largest simulated clustering value of 
+# each bin, sim_quantiles a row for each of config.sim_quantiles, and 
+# p_values the p-values that the cells are clustered and that they are 
+# dispersed (see SimStats.p_values).  All but the first three are None for 
+# the analytic null model.
+AnalysisResult = namedtuple("AnalysisResult", 
+                            "raw_cluster sim_cluster sp_output seed sim_runs "
+                            "sim_error sim_tested sim_envelope "
+                            "sim_quantiles p_values")
+
+# The cell data one file's analyses share, made by prepare.
+Prepared = namedtuple("Prepared", 
+                      "sp_data_mod xmin xmax ymin ymax ybound_list")
+
+
+def sim_correct(raw_cluster, sim_cluster):
+    """Use simulation output to density-correct clustering data.  Bins with 
+    no simulated pairs are set to 0."""
+    raw_cluster = np.asarray(raw_cluster, dtype=float)
+    sim_cluster = np.asarray(sim_cluster, dtype=float)
+    corrected_output = np.zeros(len(raw_cluster))
+    nonzero = sim_cluster != 0
+    corrected_output[nonzero] = raw_cluster[nonzero] / sim_cluster[nonzero]
+    return corrected_output
+
+
+def prepare(sp_data, config, ybound_list=None, timings=None):
+    """Do the work that every cell type pair of a data set shares: ROI 
+    boundaries, seed cells and layer bands.  Layer bands already found (for 
+    example by the cache) can be passed in as ybound_list.  With 
+    config.use_z, sp_data must have been loaded with its z column, and the 
+    z bounds are kept in the zbounds of the output's CellTable.  Each step 
+    is timed in timings."""
+    if timings is None:
+        timings = Timings()
+    if config.use_z and sp_data.z is None:
+        raise ValueError("A 3-D analysis (use_z) needs the cells loaded with "
+                         "their z coordinates")
+    if not config.use_z and sp_data.z is not None:
+        # Analyze 3-D data in 2-D
+        sp_data = sp_data.relocate(sp_data.x, sp_data.y, sp_data.seed)
+        sp_data.z = sp_data.zbounds = None
+    with timings.stage("boundaries"):
+        sp_data_mod, xmin, xmax, ymin, ymax = boundaries(
+            sp_data, config.seed_exclude, config.z_exclude_dist)
+    if not config.layers:
+        ybound_list = []
+    elif ybound_list is None:
+        with timings.stage("layer_ybound"):
+            ybound_list = layer_ybound(sp_data_mod, ymin, ymax, 
+                                       config.layer_num)
+    return Prepared(sp_data_mod, xmin, xmax, ymin, ymax, ybound_list)
+
+
+def prepare_file(path, config, timings=None):
+    """Read a data file and prepare it for analysis.  With config.use_cache 
+    the file is read through its binary cache (see cache.load_cached).  
+    Each step is timed in timings."""
+    if timings is None:
+        timings = Timings()
+    with timings.stage("load"):
+        if config.use_cache:
+            sp_data, ybound_list = load_cached(path, config.layers, 
+                                               config.layer_num, config.use_z)
+        else:
+            sp_data = load_file(path, config.layers, use_z=config.use_z)
+            ybound_list = None
+        timings.count("cells", len(sp_data))
+    return prepare(sp_data, config, ybound_list, timings)
+
+
+def analyze_pairs(prepared, pairs, config, workers=None, timings=None):
+    """Run the full analysis of every (celltype1, celltype2) pair in pairs on 
+    data made by prepare.  The raw data and each simulated layout are 
+    clustered for all the pairs in one pass, so adding pairs costs much less 
+    than analyzing them one at a time.  All pairs share one base seed.  
+    Output is a list with an AnalysisResult for each pair.  workers 
+    overrides config.sim_workers.  With config.checkpoint_dir set, the 
+    simulations are checkpointed there and resumed if interrupted.  With 
+    config.histogram_dir set, the clustering values are found from a 
+    histogram store kept there (see histogram.open_histograms), which is 
+    made or extended as needed; an analysis no store can be used or started 
+    for is run in full.  Each step is timed in timings (see 
+    timing.Timings)."""
+    if timings is None:
+        timings = Timings()
+    sp_data_mod, xmin, xmax, ymin, ymax, ybound_list = prepared
+    histograms = None
+    with timings.stage("cluster"):
+        if config.histogram_dir is not None:
+            histograms = open_histograms(prepared, pairs, config, timings)
+        if histograms is None:
+            raw_clusters = cluster_pairs(sp_data_mod, pairs, config, timings)
+        else:
+            raw_clusters = histograms.curves(histograms.raw, pairs, config)
+    if config.null_model == "analytic":
+        base_seed = sim_runs = None
+        with timings.stage("analytic"):
+            sim_clusters = [sim_analytic(sp_data_mod, celltype1, celltype2, 
+                                         xmin, xmax, ymin, ymax, ybound_list, 
+                                         config) 
+                            for celltype1, celltype2 in pairs]
+        sim_summaries = [(None, None, None, None, None)] * len(pairs)
+    elif config.null_model in ("positional", "labels"):
+        base_seed = config.random_seed
+        checkpoint = None
+        if config.checkpoint_dir is not None:
+            checkpoint = checkpoint_path(prepared, pairs, config)
+            saved = load_checkpoint(checkpoint)
+            if (base_seed is None and saved is not None and 
+                    saved[1].count < config.sim_run_num and 
+                    not saved[1].converged(config)):
+                # Carry on with the seed the interrupted analysis picked.  
+                # A finished analysis is run again with a new seed, which 
+                # replaces its checkpoint.
+                base_seed = saved[0]
+        if config.null_model == "labels":
+            # The stored runs are positional, so only the raw values come 
+            # from the histogram store.
+            sim_histograms = None
+        else:
+            sim_histograms = histograms
+        if base_seed is None and sim_histograms is not None:
+            # Use the stored runs, whatever seed they were drawn from
+            base_seed = histograms.base_seed
+        if base_seed is None:
+            base_seed = new_seed()
+        if sim_histograms is not None:
+            sim_histograms.use_seed(base_seed)
+        with timings.stage("simulations"):
+            sim_stats = sim_iterate_pairs(sp_data_mod, pairs, xmin, xmax, 
+                                          ymin, ymax, ybound_list, base_seed, 
+                                          config, workers, raw_clusters, 
+                                          checkpoint, timings, 
+                                          sim_histograms)
+        sim_runs = sim_stats.count
+        sim_clusters = sim_stats.mean
+        # One (error, tested bins, envelope, quantiles, p-values) tuple per 
+        # pair
+        sim_summaries = zip(sim_stats.relative_error(), 
+                            sim_stats.tested_bins(config), 
+                            sim_stats.envelope().swapaxes(0, 1), 
+                            sim_stats.quantiles().swapaxes(0, 1), 
+                            sim_stats.p_values().swapaxes(0, 1))
+    else:
+        raise ValueError("Unknown null model: %r" % (config.null_model,))
+    if histograms is not None:
+        with timings.stage("histograms"):
+            save_histograms(histograms)
+    with timings.stage("correct"):
+        return [AnalysisResult(raw_cluster, sim_cluster, 
+                               sim_correct(raw_cluster, sim_cluster), 
+                               base_seed, sim_runs, *sim_summary) 
+                for raw_cluster, sim_cluster, sim_summary 
+                in zip(raw_clusters, sim_clusters, sim_summaries)]
+
+
+def analyze_prepared(prepared, celltype1, celltype2, config, workers=None, 
+                     timings=None):
+    """Run the full analysis of one cell type pair on data made by 
+    prepare.  workers overrides config.sim_workers."""
+    return analyze_pairs(prepared, [(celltype1, celltype2)], config, 
+                         workers, timings)[0]
+
+
+def analyze(cells, celltype1, celltype2, config=None, workers=None, 
+            timings=None):
+    """Analyze the spatial pattern of celltype1 against celltype2 in a 
+    CellTable, with the settings in config (the defaults if None).  Output 
+    is an AnalysisResult.  Nothing is printed or saved, and no state is 
+    kept between calls, apart from the stage times added to timings if one 
+    is given."""
+    if config is None:
+        config = Config()
+    return analyze_prepared(prepare(cells, config, timings=timings), 
+                            celltype1, celltype2, config, workers, timings)
+
+
+def stats_rows(result, config):
+    """Rows of the simulation statistics of an AnalysisResult, as saved in 
+    the statistics table: the raw, simulated and corrected clustering 
+    values, the envelope and quantiles of the runs, the two p-values, the 
+    relative standard error and whether each bin was tested against 
+    config.sim_tolerance.  Output is a list of (label, values) with a value 
+    per distance bin; it is empty for the analytic null model."""
+    if result.sim_runs is None:
+        return []
+    rows = [("raw clustering value", result.raw_cluster), 
+            ("simulation clustering value", result.sim_cluster), 
+            ("output clustering value", result.sp_output), 
+            ("simulation minimum", result.sim_envelope[0]), 
+            ("simulation maximum", result.sim_envelope[1])]
+    for prob, quantile in zip(config.sim_quantiles, result.sim_quantiles):
+        rows.append(("simulation quantile " + str(prob), quantile))
+    rows += [("p clustered", result.p_values[0]), 
+             ("p dispersed", result.p_values[1]), 
+             ("relative standard error", result.sim_error), 
+             ("error tested", result.sim_tested.astype(int))]
+    return rows
@@ -0,0 +1,105 @@
+"""Analytic null model: the clustering values the positional simulations 
+average out to, computed in closed form."""
+from __future__ import absolute_import, division
+
+import math
+
+import numpy as np
+
+
+def bin_radii(config):
+    """Distance covered by each cumulative clustering bin: a pair counts 
+    toward bin k when it is no farther apart than the k-th radius."""
+    return np.minimum(np.arange(config.bins) * config.interval_num / 
+                      max(config.analysis_dist, 1), config.bins)
+
+
+def strip_overlap_integral(t, r):
+    """Integral, over the height of a seed cell, of the area of a disc of 
+    radius r around it that lies below a horizontal line.  t is the height 
+    of the line above the seed at the top of the integration range; the 
+    value is 0 once the line is below the disc.  Works on arrays."""
+    t = np.asarray(t, dtype=float)
+    r = np.asarray(r, dtype=float)
+    r_safe = np.where(r > 0, r, 1.)
+    u = np.clip(t, -r_safe, r_safe)
+    root = np.sqrt(np.maximum(r_safe ** 2 - u ** 2, 0.))
+    inside = (-root ** 3 / 3 + r_safe ** 2 * u * np.arcsin(u / r_safe) + 
+              r_safe ** 2 * root + math.pi * r_safe ** 2 * u / 2)
+    above = math.pi * r_safe ** 3 + math.pi * r_safe ** 2 * (t - r_safe)
+    value = np.where(t <= -r_safe, 0., np.where(t >= r_safe, above, inside))
+    return np.where(r > 0, value, 0.)
+
+
+def sim_analytic_direction(sp_data, celltype1, celltype2, xmin, xmax, bands, 
+                           config):
+    """Expected clustering values for one direction (celltype1 seeds, 
+    celltype2 targets) when every cell is placed at random within its own 
+    band.  bands is a list of (layer, ytop, ybottom).  For a seed at height 
+    y, the expected number of targets within r is the sum over bands of the 
+    band's cell density times the area of the disc that falls in the band; 
+    that area is integrated over the heights where the seed is far enough 
+    from the ROI edges to be used."""
+    exclude_dist = config.exclude_dist
+    ymin = min(band[2] for band in bands)
+    ymax = max(band[1] for band in bands)
+    radii = bin_radii(config)
+    width = xmax - xmin
+    seed_xfrac = max(width - 2 * exclude_dist, 0.) / width
+    expected = np.zeros(config.bins)
+    for seed_layer, seed_top, seed_bottom in bands:
+        seed_count = np.sum((sp_data.type == celltype1) & 
+                            (sp_data.layer == seed_layer))
+        y0 = max(seed_bottom, ymin + exclude_dist)
+        y1 = min(seed_top, ymax - exclude_dist)
+        if seed_count == 0 or y1 <= y0:
+            continue
+        for target_layer, target_top, target_bottom in bands:
+            target_count = np.sum((sp_data.type == celltype2) & 
+                                  (sp_data.layer == target_layer))
+            if celltype1 == celltype2 and seed_layer == target_layer:
+                # A seed cell is not counted as its own neighbor
+                target_count -= 1
+            density = target_count / (width * (target_top - target_bottom))
+            overlap = (strip_overlap_integral(target_top - y0, radii) - 
+                       strip_overlap_integral(target_top - y1, radii) - 
+                       strip_overlap_integral(target_bottom - y0, radii) + 
+                       strip_overlap_integral(target_bottom - y1, radii))
+            expected += (seed_count * seed_xfrac / (seed_top - seed_bottom) * 
+                         density * overlap)
+    return expected
+
+
+def sim_analytic(sp_data_mod, celltype1, celltype2, xmin, xmax, ymin, ymax, 
+                 ybound_list, config):
+    """Closed-form replacement for sim_iterate_pairs: the average clustering 
+    values the simulations converge to, computed directly.  Each layer's 
+    cells are spread uniformly over its band from layer_ybound (or over the 
+    whole ROI without layers), as sim_gen does.  This is exact as long as 
+    the analysis range does not reach past exclude_dist, so that no seed 
+    cell's neighborhood is cut off by the ROI boundary."""
+    if config.edge_correction is not None:
+        raise ValueError("The analytic null model cannot be used with an "
+                         "edge_correction")
+    if config.use_z:
+        raise ValueError("The analytic null model cannot be used in a 3-D "
+                         "analysis (use_z)")
+    if bin_radii(config).max() > config.exclude_dist:
+        raise ValueError("The analytic null model needs exclude_dist to be "
+                         "at least the analysis range")
+    if config.layers:
+        bands = [(layer + 1, ybound[0], ybound[1]) 
+                 for layer, ybound in enumerate(ybound_list)]
+    else:
+        bands = [(1, ymax, ymin)]
+    for layer, top, bottom in bands:
+        if top <= bottom:
+            raise ValueError("Layer %d has no height to place cells in" % 
+                             layer)
+    expected = sim_analytic_direction(sp_data_mod, celltype1, celltype2, 
+                                      xmin, xmax, bands, config)
+    if celltype1 != celltype2:
+        expected = (expected + 
+                    sim_analytic_direction(sp_data_mod, celltype2, celltype1, 
+                                           xmin, xmax, bands, config)) / 2
+    return expected
@@ -0,0 +1,99 @@
+"""Batch analysis of many data files against many cell type pairs."""
+from __future__ import absolute_import, division
+
+import csv
+import multiprocessing
+import os
+
+from spatialpattern.analysis import analyze_pairs, prepare_file, stats_rows
+from spatialpattern.shared import worker_pool
+from spatialpattern.timing import Timings
+
+
+def batch_job(job, workers=1, timings=None):
+    """Read, prepare and analyze every cell type pair of one file.  job is 
+    (path, pairs, config).  The pairs share a single pass over the data and 
+    over each simulated layout.  Output is a list of (path, celltype1, 
+    celltype2, AnalysisResult), one for each pair, and the Timings of the 
+    analysis."""
+    path, pairs, config = job
+    if timings is None:
+        timings = Timings()
+    prepared = prepare_file(path, config, timings)
+    results = analyze_pairs(prepared, pairs, config, workers, timings)
+    return [(path, celltype1, celltype2, result) 
+            for (celltype1, celltype2), result in zip(pairs, results)], timings
+
+
+def batch_run(paths, pairs, config, workers=None, timings=None):
+    """Analyze every file in paths for every (celltype1, celltype2) pair in 
+    pairs.  Each file is read and prepared once, and all of its pairs are 
+    analyzed together.  With several files, the files are shared out over a 
+    pool of config.sim_workers processes (or workers, if given), and each 
+    is read and prepared by the worker that analyzes it, so only the files 
+    being worked on are held in memory; a single file uses the pool for its 
+    simulations instead.  Yields (path, celltype1, celltype2, 
+    AnalysisResult) for each file and pair, in order, as they finish.  
+    Each step is timed in timings, summed over the workers."""
+    if timings is None:
+        timings = Timings()
+    jobs = [(path, pairs, config) for path in paths]
+    if workers is None:
+        workers = config.sim_workers
+    workers = workers or multiprocessing.cpu_count()
+    if workers == 1 or len(jobs) == 1:
+        for job in jobs:
+            for job_result in batch_job(job, workers, timings)[0]:
+                yield job_result
+        return
+    pool = worker_pool(workers)
+    try:
+        for job_results, job_timings in pool.imap(batch_job, jobs):
+            timings.merge(job_timings)
+            for job_result in job_results:
+                yield job_result
+    finally:
+        pool.terminate()
+        pool.join()
+
+
+def write_batch_table(out_path, job_results, config, progress=None, 
+                      stats_path=None):
+    """Save batch results as one tab-delimited table with a row of corrected 
+    clustering values per (file, pair) job, after the base seed of its 
+    simulations (empty for the analytic null model), so that a job run 
+    with random_seed None can be repeated.  job_results is the output of 
+    batch_run; if progress is given, it is called with each job's (path, 
+    celltype1, celltype2, result) as the job is written.  If stats_path is 
+    given, the simulation statistics of every job (see 
+    analysis.stats_rows) are saved there too, as a second table with a row 
+    per job and statistic."""
+    bin_labels = [str(location) + " um" for location in range(config.bins)]
+    with open(out_path, "w") as out_file:
+        output_writer = csv.writer(out_file, delimiter="\t", quotechar="|", 
+                                   quoting=csv.QUOTE_MINIMAL)
+        output_writer.writerow(["file", "celltype1", "celltype2", "seed"] + 
+                               bin_labels)
+        stats_file = stats_writer = None
+        if stats_path is not None:
+            stats_file = open(stats_path, "w")
+            stats_writer = csv.writer(stats_file, delimiter="\t", 
+                                      quotechar="|", 
+                                      quoting=csv.QUOTE_MINIMAL)
+            stats_writer.writerow(["file", "celltype1", "celltype2", 
+                                   "statistic"] + bin_labels)
+        try:
+            for job_result in job_results:
+                path, celltype1, celltype2, result = job_result
+                job = [os.path.basename(path), celltype1, celltype2]
+                output_writer.writerow(job + [result.seed] + 
+                                       result.sp_output.tolist())
+                if stats_writer is not None:
+                    for label, values in stats_rows(result, config):
+                        stats_writer.writerow(job + [label] + 
+                                              values.tolist())
+                if progress is not None:
+                    progress(job_result)
+        finally:
+            if stats_file is not None:
+                stats_file.close()
@@ -0,0 +1,112 @@
+"""Binary cache of parsed data files.  The first analysis of a file saves 
+its cells, ROI bounds and layer bands next to it as .npy arrays; later 
+analyses memory-map those arrays instead of parsing the text again.  The 
+cache is keyed by a hash of the data file, so it is rebuilt automatically 
+when the file changes."""
+from __future__ import absolute_import, division
+
+import hashlib
+import json
+import os
+
+import numpy as np
+
+from spatialpattern.cells import CellTable, layer_ybound, load_file
+
+# Bump this whenever the layout of the cache, or the way its layer bands are 
+# found, changes, so old caches are rebuilt rather than misread.
+CACHE_VERSION = 2
+
+CACHE_COLUMNS = ("type", "x", "y", "layer")
+
+# Also saved for data loaded with use_z
+CACHE_Z_COLUMN = "z"
+
+
+def file_hash(path):
+    """SHA-1 hash of a file's contents, read in 1 MB pieces."""
+    digest = hashlib.sha1()
+    with open(path, "rb") as data_file:
+        for piece in iter(lambda: data_file.read(2 ** 20), b""):
+            digest.update(piece)
+    return digest.hexdigest()
+
+
+def cache_dir(path):
+    """Directory holding the cache of a data file."""
+    return path + ".spcache"
+
+
+def save_cache(path, sp_data, ybound_list, layers, layer_num, digest):
+    """Save a loaded data file's cells, bounds and layer bands to its cache 
+    directory, with the z column and zbounds of 3-D data.  The metadata 
+    file is removed first and written last, so a cache that was only partly 
+    written is never used."""
+    directory = cache_dir(path)
+    meta_path = os.path.join(directory, "meta.json")
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    elif os.path.exists(meta_path):
+        os.remove(meta_path)
+    use_z = sp_data.z is not None
+    for column in CACHE_COLUMNS + ((CACHE_Z_COLUMN,) if use_z else ()):
+        np.save(os.path.join(directory, column + ".npy"), 
+                getattr(sp_data, column))
+    meta = {"version": CACHE_VERSION, "hash": digest, "layers": layers, 
+            "layer_num": layer_num, "bounds": list(sp_data.bounds), 
+            "ybound_list": ybound_list, "use_z": use_z, 
+            "zbounds": list(sp_data.zbounds) if use_z else None}
+    with open(meta_path, "w") as meta_file:
+        json.dump(meta, meta_file)
+
+
+def open_cache(path, layers, digest, use_z=False):
+    """Memory-map the cache of a data file.  Output is the CellTable and the 
+    cache metadata, or None if there is no cache for this version of the 
+    file and setting of layers and use_z."""
+    directory = cache_dir(path)
+    try:
+        with open(os.path.join(directory, "meta.json")) as meta_file:
+            meta = json.load(meta_file)
+    except (IOError, OSError, ValueError):
+        return None
+    if (meta.get("version") != CACHE_VERSION or meta.get("hash") != digest or 
+            meta.get("layers") != layers or 
+            meta.get("use_z", False) != use_z):
+        return None
+    columns = [np.load(os.path.join(directory, column + ".npy"), 
+                       mmap_mode="r") 
+               for column in CACHE_COLUMNS + ((CACHE_Z_COLUMN,) if use_z 
+                                              else ())]
+    sp_data = CellTable.from_sorted(*columns)
+    sp_data.bounds = tuple(meta["bounds"])
+    if use_z:
+        sp_data.zbounds = tuple(meta["zbounds"])
+    return sp_data, meta
+
+
+def load_cached(path, layers=True, layer_num=6, use_z=False):
+    """Load a data file through its cache, building the cache if it is 
+    missing or out of date.  Output is the CellTable, memory-mapped from 
+    the cache, and the layer bands from layer_ybound (an empty list without 
+    layers).  use_z keeps the z column, as in load_file."""
+    digest = file_hash(path)
+    cached = open_cache(path, layers, digest, use_z)
+    if cached is None:
+        sp_data = load_file(path, layers, use_z=use_z)
+        if layers:
+            xmin, xmax, ymin, ymax = sp_data.bounds
+            ybound_list = layer_ybound(sp_data, ymin, ymax, layer_num)
+        else:
+            ybound_list = []
+        save_cache(path, sp_data, ybound_list, layers, layer_num, digest)
+        cached = open_cache(path, layers, digest, use_z)
+    sp_data, meta = cached
+    if not layers:
+        ybound_list = []
+    elif meta["layer_num"] == layer_num:
+        ybound_list = meta["ybound_list"]
+    else:
+        xmin, xmax, ymin, ymax = sp_data.bounds
+        ybound_list = layer_ybound(sp_data, ymin, ymax, layer_num)
+    return sp_data, ybound_list
@@ -0,0 +1,286 @@
+"""Cell tables: loading coordinate files, ROI boundaries, seed cells and 
+layer bands."""
+from __future__ import absolute_import, division
+
+import itertools
+
+import numpy as np
+
+
+class CellTable(object):
+    """Columnar store for a set of cells.  Cell type, x, y and layer are 
+    each kept in one typed array, and seed is a boolean array (filled in by 
+    boundaries) marking the cells far enough from the ROI boundaries to be 
+    used as seed cells.  For a 3-D analysis z holds the depth of each cell 
+    and zbounds the (zmin, zmax) ROI bounds in depth; both are None for 2-D 
+    data.  The cells are sorted by type, and slices maps each cell type to 
+    the slice of the arrays holding its cells.  Simulated layouts are made 
+    with relocate, which shares everything but the coordinates and seed 
+    mask with the real cells."""
+
+    def __init__(self, types, x, y, layer, z=None):
+        order = np.argsort(np.asarray(types, dtype=np.int16), kind="mergesort")
+        self.type = np.asarray(types, dtype=np.int16)[order]
+        self.x = np.asarray(x, dtype=float)[order]
+        self.y = np.asarray(y, dtype=float)[order]
+        self.layer = np.asarray(layer, dtype=np.int8)[order]
+        self.z = None if z is None else np.asarray(z, dtype=float)[order]
+        self.seed = np.zeros(len(self.type), dtype=bool)
+        self.bounds = None
+        self.zbounds = None
+        type_list, starts = np.unique(self.type, return_index=True)
+        stops = np.r_[starts[1:], len(self.type)]
+        self.slices = dict((int(celltype), slice(start, stop)) 
+                           for celltype, start, stop 
+                           in zip(type_list, starts, stops))
+
+    @classmethod
+    def from_sorted(cls, types, x, y, layer, z=None):
+        """Make a CellTable from arrays that are already sorted by type and 
+        have the right types, such as those saved by the cache.  The arrays 
+        are used as they are, not copied."""
+        sp_data = cls.__new__(cls)
+        sp_data.type, sp_data.x, sp_data.y, sp_data.layer = types, x, y, layer
+        sp_data.z = z
+        sp_data.seed = np.zeros(len(types), dtype=bool)
+        sp_data.bounds = sp_data.zbounds = None
+        starts = np.r_[0, np.flatnonzero(types[1:] != types[:-1]) + 1]
+        stops = np.r_[starts[1:], len(types)]
+        sp_data.slices = dict((int(types[start]), slice(start, stop)) 
+                              for start, stop in zip(starts, stops) 
+                              if start < stop)
+        return sp_data
+
+    def __len__(self):
+        return len(self.type)
+
+    def relocate(self, x, y, seed, z=None):
+        """Return the same cells at new x and y coordinates (and new z 
+        coordinates, if given) with a new seed mask.  The type, layer and 
+        slices arrays are shared, not copied."""
+        moved = CellTable.__new__(CellTable)
+        moved.__dict__.update(self.__dict__)
+        moved.x, moved.y, moved.seed = x, y, seed
+        if z is not None:
+            moved.z = z
+        return moved
+
+
+def load_file(path, layers=True, chunk_lines=65536, use_z=False):
+    """Load a tab-delimited cell coordinate file, streaming it in chunks of 
+    chunk_lines lines straight into typed arrays, so that very large 
+    exports load with bounded memory.  Both file layouts are read: the 
+    prepared layout (a header line, then cell type, x, y and layer columns) 
+    and the raw Stereo Investigator export (a "; Marker Coordinate File" 
+    preamble, then cell type, x, y, z and further columns).  Lines starting 
+    with ";", blank lines and a header line are skipped, and columns past 
+    the ones used are ignored.  Without layers, every cell is put in layer 
+    1.  With use_z, the z column of a raw export is kept for a 3-D 
+    analysis; the layer, if any, is then read from the column after it.  
+    Output is a CellTable, which contains all cells; its bounds (xmin, 
+    xmax, ymin, ymax), and with use_z its zbounds (zmin, zmax), are found 
+    while reading."""
+    used_columns = (4 if layers else 3) + (1 if use_z else 0)
+    chunks = []
+    xmin = ymin = zmin = float("inf")
+    xmax = ymax = zmax = float("-inf")
+    line_num = 0
+    with open(path, "r") as myfileobj:
+        while True:
+            lines = list(itertools.islice(myfileobj, chunk_lines))
+            if not lines:
+                break
+            rows, row_lines = [], []
+            for line in lines:
+                line_num += 1
+                fields = line.rstrip("\r\n").split("\t")
+                first = fields[0].strip()
+                if not first or first.startswith(";"):
+                    continue
+                if not rows and not chunks and not is_number(first):
+                    # Header line
+                    continue
+                if len(fields) < used_columns:
+                    raise ValueError("%s line %d: expected %d columns, found "
+                                     "%d" % (path, line_num, used_columns, 
+                                             len(fields)))
+                rows.append(fields[:used_columns])
+                row_lines.append(line_num)
+            if not rows:
+                continue
+            columns = parse_columns(rows, row_lines, path)
+            whole = columns[0] == np.floor(columns[0])
+            if not whole.all():
+                raise ValueError("%s line %d: the cell type must be a whole "
+                                 "number" % 
+                                 (path, row_lines[np.argmin(whole)]))
+            if use_z:
+                z_column = columns.pop(3)
+                zmin = min(zmin, z_column.min())
+                zmax = max(zmax, z_column.max())
+            if layers:
+                whole = columns[3] == np.floor(columns[3])
+                if not whole.all():
+                    raise ValueError("%s line %d: the layer must be a whole "
+                                     "number (a raw export has z in this "
+                                     "column; add layers, set layers to "
+                                     "False or set use_z)" % 
+                                     (path, row_lines[np.argmin(whole)]))
+            if not layers:
+                columns.append(np.ones(len(rows)))
+            if use_z:
+                columns.append(z_column)
+            xmin = min(xmin, columns[1].min())
+            xmax = max(xmax, columns[1].max())
+            ymin = min(ymin, columns[2].min())
+            ymax = max(ymax, columns[2].max())
+            chunks.append(columns)
+    if chunks:
+        columns = [np.concatenate(column) for column in zip(*chunks)]
+    else:
+        columns = [[]] * (5 if use_z else 4)
+    sp_data = CellTable(*columns)
+    if chunks:
+        sp_data.bounds = (float(xmin), float(xmax), float(ymin), float(ymax))
+        if use_z:
+            sp_data.zbounds = (float(zmin), float(zmax))
+    return sp_data
+
+
+def is_number(text):
+    """True if text can be read as a number."""
+    try:
+        float(text)
+    except ValueError:
+        return False
+    return True
+
+
+def parse_columns(rows, row_lines, path):
+    """Convert a chunk of rows of text fields to one float array per 
+    column.  row_lines holds the file line number of each row, used to 
+    report the first line that cannot be read."""
+    try:
+        return [np.array(column, dtype=float) for column in zip(*rows)]
+    except ValueError:
+        for row, line_num in zip(rows, row_lines):
+            for field in row:
+                if not is_number(field):
+                    raise ValueError("%s line %d: %r is not a number" % 
+                                     (path, line_num, field))
+        raise
+
+
+def edge_mask(x, y, xmin, xmax, ymin, ymax, exclude_dist):
+    """Mark the cells that are more than exclude_dist from every ROI 
+    boundary, and so can be used as seed cells.  x and y may be arrays of 
+    any shape."""
+    return ((np.abs(x - xmin) > exclude_dist) & 
+            (np.abs(xmax - x) > exclude_dist) & 
+            (np.abs(y - ymin) > exclude_dist) & 
+            (np.abs(ymax - y) > exclude_dist))
+
+
+def edge_distance(x, y, xmin, xmax, ymin, ymax):
+    """Distance from each cell to the nearest ROI boundary.  A cell is a 
+    seed cell (see edge_mask) exactly when this is more than exclude_dist.  
+    x and y may be arrays of any shape."""
+    return np.minimum(np.minimum(np.abs(x - xmin), np.abs(xmax - x)), 
+                      np.minimum(np.abs(y - ymin), np.abs(ymax - y)))
+
+
+def slab_mask(z, zmin, zmax, z_exclude_dist):
+    """Mark the cells that are more than z_exclude_dist from both faces of 
+    the section, and so can be used as seed cells in a 3-D analysis.  With 
+    z_exclude_dist None no cell is excluded, as suits sections thinner than 
+    the analysis range.  z may be an array of any shape."""
+    if z_exclude_dist is None:
+        return np.ones(np.shape(z), dtype=bool)
+    return ((np.abs(z - zmin) > z_exclude_dist) & 
+            (np.abs(zmax - z) > z_exclude_dist))
+
+
+def boundaries(sp_data, exclude_dist, z_exclude_dist=None):
+    """ This function finds the max and min x and y ROI boundaries in the data 
+    file, unless load_file already found them.  Output is a copy of sp_data 
+    with the seed cells, those far enough from all of these boundaries, 
+    marked in its seed array, followed by the boundaries themselves.  For 
+    3-D data (with a z column) the zbounds are found too, and seed cells 
+    must also be more than z_exclude_dist from both faces of the section 
+    (see slab_mask)."""
+    if sp_data.bounds is not None:
+        xmin, xmax, ymin, ymax = sp_data.bounds
+    else:
+        xmin, xmax = float(sp_data.x.min()), float(sp_data.x.max())
+        ymin, ymax = float(sp_data.y.min()), float(sp_data.y.max())
+    seed = edge_mask(sp_data.x, sp_data.y, xmin, xmax, ymin, ymax, 
+                     exclude_dist)
+    zbounds = None
+    if sp_data.z is not None:
+        zbounds = sp_data.zbounds
+        if zbounds is None:
+            zbounds = (float(sp_data.z.min()), float(sp_data.z.max()))
+        seed &= slab_mask(sp_data.z, zbounds[0], zbounds[1], z_exclude_dist)
+    sp_data_mod = sp_data.relocate(sp_data.x, sp_data.y, seed)
+    sp_data_mod.bounds = (xmin, xmax, ymin, ymax)
+    sp_data_mod.zbounds = zbounds
+    return sp_data_mod, xmin, xmax, ymin, ymax
+
+
+def layer_ybound(sp_data_mod, ymin, ymax, layer_num):
+    """This function sets boundaries by layer so that when random cell 
+    location simulations are generated, they are performed by layer.  
+    This is necessary because cell density varies by layer.  Layers are 
+    numbered from 1 at the top.  The highest and lowest cell of every layer 
+    are found in one pass over the cells; each boundary between two layers 
+    is then put halfway between the lowest cell of the upper layer and the 
+    highest cell of the layer below, and the top and bottom bands are 
+    stretched to ymax and ymin.  Output is a [top, bottom, layer] list for 
+    each layer.  A ValueError names any layer with no cells, or any layer 
+    number outside 1 to layer_num."""
+    layer = np.asarray(sp_data_mod.layer, dtype=np.int64)
+    outside = (layer < 1) | (layer > layer_num)
+    if outside.any():
+        raise ValueError("Cells are marked as layer %s, but layer_num is %d" 
+                         % (layer_names(np.unique(layer[outside])), 
+                            layer_num))
+    empty = np.flatnonzero(np.bincount(layer - 1, minlength=layer_num) == 0)
+    if len(empty):
+        raise ValueError("No cells are marked as layer %s of the %d layers; "
+                         "check layer_num and the layer column of the data" 
+                         % (layer_names(empty + 1), layer_num))
+    layer_max = np.full(layer_num, -np.inf)
+    layer_min = np.full(layer_num, np.inf)
+    np.maximum.at(layer_max, layer - 1, sp_data_mod.y)
+    np.minimum.at(layer_min, layer - 1, sp_data_mod.y)
+    ybound_list = [[float(layer_max[number]), float(layer_min[number]), 
+                    number + 1] 
+                   for number in range(layer_num)]
+    # Set layer boundaries by averaging the min from one layer with the max 
+    # from the next layer.
+    for upper, lower in zip(ybound_list[:-1], ybound_list[1:]):
+        upper[1] = lower[0] = (upper[1] + lower[0]) / 2
+    ybound_list[0][0], ybound_list[-1][1] = ymax, ymin
+    return ybound_list
+
+
+def layer_names(numbers):
+    """Layer numbers as text for messages, such as "2", "2 or 4" or "2, 4 
+    or 5"."""
+    numbers = [str(number) for number in numbers]
+    if len(numbers) < 2:
+        return "".join(numbers)
+    return ", ".join(numbers[:-1]) + " or " + numbers[-1]
+
+
+def cell_lists(sp_data):
+    """Convert a CellTable into the cell lists used by cluster_python: 
+    [celltype, x, y, layer, xmin_dist, xmax_dist, ymin_dist, ymax_dist] for 
+    each cell."""
+    xmin, xmax, ymin, ymax = sp_data.bounds
+    return [[celltype, x, y, layer, abs(x - xmin), abs(xmax - x), 
+             abs(y - ymin), abs(ymax - y)] 
+            for celltype, x, y, layer in zip(sp_data.type.tolist(), 
+                                             sp_data.x.tolist(), 
+                                             sp_data.y.tolist(), 
+                                             sp_data.layer.tolist())]
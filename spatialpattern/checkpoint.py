@@ -0,0 +1,71 @@
+"""Checkpoints of long simulation campaigns, so that an interrupted run can 
+carry on where it stopped.  A checkpoint holds the base seed and the SimStats 
+of the runs made so far; since every run draws from its own seed, that is 
+all that is needed to continue exactly as an uninterrupted run would."""
+from __future__ import absolute_import, division
+
+import hashlib
+import os
+import pickle
+
+# Settings that do not change the simulation runs or their statistics.  A 
+# checkpoint can be resumed with any of these changed, for example to ask 
+# for more runs or to use more workers.
+RESUMABLE_SETTINGS = ("sim_run_num", "sim_tolerance", 
+                      "sim_tolerance_min_count", "sim_min_runs", 
+                      "sim_workers", "engine", "use_jit", "tile_size", 
+                      "use_cache", "checkpoint_dir", "checkpoint_every", 
+                      "histogram_dir", "histogram_max_exclude")
+
+
+def checkpoint_path(prepared, pairs, config):
+    """Checkpoint file for the simulations of some cell type pairs of a 
+    prepared data set, in config.checkpoint_dir.  The file name is a hash 
+    of the cells, the ROI, the pairs and the settings the runs depend on, 
+    so each analysis has its own checkpoint."""
+    digest = hashlib.sha1()
+    sp_data_mod = prepared.sp_data_mod
+    for column in (sp_data_mod.type, sp_data_mod.x, sp_data_mod.y, 
+                   sp_data_mod.layer, sp_data_mod.seed):
+        digest.update(column.tobytes())
+    if sp_data_mod.z is not None:
+        digest.update(sp_data_mod.z.tobytes())
+        digest.update(repr(sp_data_mod.zbounds).encode("utf-8"))
+    settings = [(name, getattr(config, name)) 
+                for name, value in config.defaults 
+                if name not in RESUMABLE_SETTINGS]
+    digest.update(repr((tuple(prepared[1:]), list(pairs), 
+                        settings)).encode("utf-8"))
+    return os.path.join(config.checkpoint_dir, 
+                        "sim_" + digest.hexdigest() + ".ckpt")
+
+
+def load_checkpoint(path, base_seed=None):
+    """Read a checkpoint.  Output is its (base_seed, SimStats), or None if 
+    there is no checkpoint, or it was made with a base seed other than 
+    base_seed (when one is given)."""
+    try:
+        with open(path, "rb") as checkpoint_file:
+            saved = pickle.load(checkpoint_file)
+    except (IOError, OSError, EOFError, pickle.UnpicklingError):
+        return None
+    if base_seed is not None and saved["base_seed"] != base_seed:
+        return None
+    return saved["base_seed"], saved["sim_stats"]
+
+
+def save_checkpoint(path, base_seed, sim_stats):
+    """Save a checkpoint.  It is written to a temporary file first and then 
+    renamed over the old one, so a crash while saving leaves the previous 
+    checkpoint intact."""
+    directory = os.path.dirname(path)
+    if directory and not os.path.isdir(directory):
+        os.makedirs(directory)
+    temp_path = path + ".tmp"
+    with open(temp_path, "wb") as checkpoint_file:
+        pickle.dump({"base_seed": base_seed, "sim_stats": sim_stats}, 
+                    checkpoint_file, 2)
+    if os.name == "nt" and os.path.exists(path):
+        # os.rename cannot replace a file on Windows
+        os.remove(path)
+    os.rename(temp_path, path)
@@ -0,0 +1,67 @@
+"""Analysis settings, passed explicitly to every step of the analysis."""
+
+
+class Config(object):
+    """Settings for one spatial pattern analysis.  Every setting has the 
+    same name and meaning as the user set variable of the same name in 
+    SpatialPatternAnalysis.py; any that are not given keep the defaults 
+    below.  A Config is never changed by the analysis, so one can be shared 
+    by any number of analyses at once."""
+
+    defaults = (("layers", True), 
+                ("layer_num", 6), 
+                ("use_z", False), 
+                ("exclude_dist", 100), 
+                ("z_exclude_dist", None), 
+                ("edge_correction", None), 
+                ("analysis_dist", 100), 
+                ("interval_num", 100), 
+                ("sim_run_num", 5), 
+                ("sim_tolerance", None), 
+                ("sim_tolerance_min_count", None), 
+                ("sim_min_runs", 20), 
+                ("sim_quantiles", (0.025, 0.975)), 
+                ("null_model", "positional"), 
+                ("sim_workers", 1), 
+                ("random_seed", None), 
+                ("engine", "grid"), 
+                ("use_jit", True), 
+                ("tile_size", None), 
+                ("use_cache", False), 
+                ("checkpoint_dir", None), 
+                ("checkpoint_every", 50), 
+                ("histogram_dir", None), 
+                ("histogram_max_exclude", None))
+
+    def __init__(self, **settings):
+        for name, value in self.defaults:
+            setattr(self, name, settings.pop(name, value))
+        if settings:
+            raise TypeError("Unknown settings: " + ", ".join(sorted(settings)))
+
+    def __repr__(self):
+        return "Config(%s)" % ", ".join("%s=%r" % (name, getattr(self, name)) 
+                                        for name, value in self.defaults)
+
+    @property
+    def bins(self):
+        """Number of clustering bins.  There is one more bin than 
+        analysis_dist so that the output runs from zero to analysis_dist, 
+        *inclusive*."""
+        return self.analysis_dist + 1
+
+    @property
+    def seed_exclude(self):
+        """Distance from the ROI boundaries within which cells are not used 
+        as seed cells: exclude_dist, or minus infinity, so that every cell 
+        is a seed cell, when edge_correction is set."""
+        if self.edge_correction is not None:
+            return float("-inf")
+        return self.exclude_dist
+
+    def replace(self, **changes):
+        """Return a copy of this Config with some settings changed."""
+        settings = dict((name, getattr(self, name)) 
+                        for name, value in self.defaults)
+        settings.update(changes)
+        return Config(**settings)
@@ -0,0 +1,514 @@
+"""Clustering engines.  Each engine counts, for every seed cell of one type, 
+the cells of a second type within each distance bin of the analysis range, 
+and returns the cumulative clustering values.  All engines give identical 
+values; select one with Config.engine."""
+from __future__ import absolute_import, division
+
+import math
+
+import numpy as np
+
+from spatialpattern import kernels
+from spatialpattern.cells import CellTable, cell_lists
+from spatialpattern.timing import Timings
+
+
+def cluster(sp_data, celltype1, celltype2, config):
+    """Generate clustering values for a CellTable using the engine selected 
+    in config.  The grid engine counts the pairs with pair_counts, as 
+    cluster_pairs does.  The edge correction and 3-D analyses are only made 
+    by cluster_pairs."""
+    if config.edge_correction is not None:
+        raise ValueError("Use cluster_pairs for an edge_correction")
+    if config.use_z:
+        raise ValueError("Use cluster_pairs for a 3-D analysis (use_z)")
+    if config.engine == "python":
+        return cluster_python(cell_lists(sp_data), celltype1, celltype2, 
+                              config)
+    if config.engine == "grid":
+        types = sorted(set([celltype1, celltype2]))
+        return cluster_tensor(sp_data, types, config)[
+            types.index(celltype1), types.index(celltype2)]
+    if config.engine == "numpy":
+        return cluster_numpy(sp_data, celltype1, celltype2, config)
+    raise ValueError("Unknown engine: %r" % (config.engine,))
+
+
+def cluster_python(sp_data, celltype1, celltype2, config):
+    """Generate clustering values one cell pair at a time, from the cell 
+    lists made by cell_lists.  This is the reference version; it is the main 
+    time sink of the program when selected."""
+    analysis_dist = config.bins
+    exclude_dist = config.exclude_dist
+    interval_num = config.interval_num
+    class1_cells = [cell for cell in sp_data if cell[0] == celltype1]
+    class2_cells = [cell for cell in sp_data if cell[0] == celltype2]
+    raw_cluster = [0.] * (analysis_dist)
+    analysis_dist_squared = analysis_dist ** 2
+    for cell1 in class1_cells:
+        if (cell1[4] > exclude_dist and cell1[5] > exclude_dist and 
+            cell1[6] > exclude_dist and cell1[7] > exclude_dist):
+            # Setting these variables here shaves ~7-8% off runtime
+            xloc = cell1[1]
+            yloc = cell1[2]
+            for cell2 in class2_cells:
+                dist_squared = (xloc - cell2[1]) ** 2 + (yloc - cell2[2]) ** 2
+                if 0 < dist_squared < analysis_dist_squared:
+                    dist = math.sqrt(dist_squared)
+                    array_target = int(math.ceil(dist * (analysis_dist - 1) / 
+                                                 interval_num))
+                    for insert in range(array_target, analysis_dist):
+                        raw_cluster[insert] += 1
+    return np.array(raw_cluster)
+
+
+def bin_index(dist_squared, config):
+    """Distance bin of each cell pair, from an array of squared seed-to-cell 
+    distances.  The binning matches cluster_python exactly; pairs outside 
+    the analysis range get -1."""
+    analysis_dist = config.bins
+    array_target = np.full(np.shape(dist_squared), -1, dtype=np.int64)
+    in_range = (dist_squared > 0) & (dist_squared < analysis_dist ** 2)
+    target = np.ceil(np.sqrt(dist_squared[in_range]) * (analysis_dist - 1) / 
+                     config.interval_num).astype(np.int64)
+    array_target[in_range] = np.where(target < analysis_dist, target, -1)
+    return array_target
+
+
+def bin_counts(dist_squared, config):
+    """Count the cell pairs falling into each distance bin.  Input is an 
+    array of squared seed-to-cell distances; the cumulative sum of the 
+    output is the clustering curve."""
+    array_target = bin_index(dist_squared, config)
+    return np.bincount(array_target[array_target >= 0], 
+                       minlength=config.bins)
+
+
+def cluster_numpy(sp_data, celltype1, celltype2, config):
+    """Generate clustering values with NumPy.  Distances from a block of 
+    seed cells to every class2 cell are computed in one step and binned with 
+    bin_counts; the cumulative curve is then built with a single cumsum 
+    instead of incrementing every farther bin for each match."""
+    class1 = sp_data.slices.get(celltype1, slice(0, 0))
+    class2 = sp_data.slices.get(celltype2, slice(0, 0))
+    seed1 = sp_data.seed[class1]
+    xseed, yseed = sp_data.x[class1][seed1], sp_data.y[class1][seed1]
+    x2, y2 = sp_data.x[class2], sp_data.y[class2]
+    counts = np.zeros(config.bins, dtype=np.int64)
+    # Work through the seeds in blocks so that the distance matrix stays 
+    # around 4 million entries no matter how large the data set is.
+    block = max(1, 2 ** 22 // max(1, len(x2)))
+    for start in range(0, len(xseed), block):
+        xloc = xseed[start:start + block, np.newaxis]
+        yloc = yseed[start:start + block, np.newaxis]
+        dist_squared = (xloc - x2) ** 2 + (yloc - y2) ** 2
+        counts += bin_counts(dist_squared.ravel(), config)
+    return np.cumsum(counts).astype(float)
+
+
+def cluster_tensor(sp_data, types, config, timings=None):
+    """Generate the clustering values of every ordered pair of the cell 
+    types in types (sorted, no repeats) in one sweep of pair_counts.  Entry 
+    [i, j] of the output is what cluster would give for types[i] against 
+    types[j].  The work done is counted in timings (see pair_counts)."""
+    return np.cumsum(pair_counts(sp_data, types, config, timings=timings)[
+        :, :, 0], axis=2).astype(float)
+
+
+def grid_sweep(sp_data, types, config, timings=None):
+    """Set up a sweep over every cell pair within range among the cells of 
+    the cell types in types (sorted, no repeats).  The cells of those types 
+    are sorted into grid squares one analysis range wide, so that every 
+    cell within range of a cell lies in its own square or one of the 8 
+    around it.  Each cell pair within range is then measured only once: 
+    every cell is compared with the cells after it in its own square and 
+    with the cells of the 4 squares above and to the right of it.  With 
+    config.use_z the cells are sorted into cubes instead, and compared with 
+    the cells of the 13 cubes of the half of the 3 x 3 x 3 block around 
+    their own that comes after it.  Output is a dict of the swept cells in 
+    sweep order (their index in sp_data as cells, then x, y, z (None for 
+    2-D), type_idx, the index of their type in types, and seed), and for 
+    each cell the starts and stops of the slices of later cells to compare 
+    it with (3 in 2-D, 6 in 3-D), their lengths and the running total of 
+    pairs; or None if there are no cells of those types.  The number of 
+    seed cells and pair distances to measure are counted in timings."""
+    if timings is None:
+        timings = Timings()
+    bins = config.bins
+    types = np.asarray(types, dtype=np.int64)
+    cells = np.flatnonzero(np.isin(sp_data.type, types))
+    if not len(cells):
+        return None
+    if config.use_z:
+        return cube_sweep(sp_data, types, cells, config, timings)
+    x, y = sp_data.x[cells], sp_data.y[cells]
+    gx = np.floor((x - x.min()) / bins).astype(np.int64)
+    gy = np.floor((y - y.min()) / bins).astype(np.int64)
+    nx, ny = int(gx.max()) + 1, int(gy.max()) + 1
+    key = gx * ny + gy
+    order = np.argsort(key, kind="mergesort")
+    key, gx, gy = key[order], gx[order], gy[order]
+    cells = cells[order]
+    # For each cell, the slices of later cells to compare it with: the rest 
+    # of its own square, the square above, and the 3 squares of the next 
+    # column (empty where the grid ends).
+    col = (gx + 1) * ny
+    starts = np.column_stack([
+        np.arange(1, len(key) + 1), np.searchsorted(key, key + 1), 
+        np.searchsorted(key, col + np.maximum(gy - 1, 0))])
+    stops = np.column_stack([
+        np.searchsorted(key, key, side="right"), 
+        np.where(gy + 1 < ny, np.searchsorted(key, key + 2), starts[:, 1]), 
+        np.where(gx + 1 < nx, 
+                 np.searchsorted(key, col + np.minimum(gy + 2, ny)), 
+                 starts[:, 2])])
+    return sweep_dict(sp_data, types, cells, x[order], y[order], None, 
+                      starts, stops, timings)
+
+
+def cube_sweep(sp_data, types, cells, config, timings):
+    """The 3-D version of grid_sweep, for the cells (indices into sp_data) 
+    of the cell types in types.  The cells are sorted into cubes one 
+    analysis range wide, so that each run of up to 3 cubes along z is one 
+    contiguous slice."""
+    bins = config.bins
+    x, y, z = sp_data.x[cells], sp_data.y[cells], sp_data.z[cells]
+    gx = np.floor((x - x.min()) / bins).astype(np.int64)
+    gy = np.floor((y - y.min()) / bins).astype(np.int64)
+    gz = np.floor((z - z.min()) / bins).astype(np.int64)
+    nx, ny, nz = int(gx.max()) + 1, int(gy.max()) + 1, int(gz.max()) + 1
+    key = (gx * ny + gy) * nz + gz
+    order = np.argsort(key, kind="mergesort")
+    key, gx, gy, gz = key[order], gx[order], gy[order], gz[order]
+    cells = cells[order]
+    z_low, z_high = np.maximum(gz - 1, 0), np.minimum(gz + 2, nz)
+    # For each cell, the slices of later cells to compare it with: the rest 
+    # of its own cube, the cube above it in z, the 3 cubes along z of the 
+    # next row, and those of the 3 rows of the next column (empty where the 
+    # grid ends).
+    starts = [np.arange(1, len(key) + 1), np.searchsorted(key, key + 1)]
+    stops = [np.searchsorted(key, key, side="right"), 
+             np.where(gz + 1 < nz, np.searchsorted(key, key + 2), starts[1])]
+    for x_step, y_step in ((0, 1), (1, -1), (1, 0), (1, 1)):
+        column, row = gx + x_step, gy + y_step
+        inside = (column < nx) & (row >= 0) & (row < ny)
+        base = (np.minimum(column, nx - 1) * ny + 
+                np.clip(row, 0, ny - 1)) * nz
+        starts.append(np.searchsorted(key, base + z_low))
+        stops.append(np.where(inside, np.searchsorted(key, base + z_high), 
+                              starts[-1]))
+    return sweep_dict(sp_data, types, cells, x[order], y[order], z[order], 
+                      np.column_stack(starts), np.column_stack(stops), 
+                      timings)
+
+
+def sweep_dict(sp_data, types, cells, x, y, z, starts, stops, timings):
+    """Output of grid_sweep for the swept cells, in sweep order, and the 
+    slices of later cells to compare each with."""
+    lengths = stops - starts
+    sweep = {"cells": cells, "x": x, "y": y, "z": z, 
+             "type_idx": np.searchsorted(types, sp_data.type[cells]), 
+             "seed": sp_data.seed[cells], "starts": starts, "stops": stops, 
+             "lengths": lengths, 
+             "pair_total": np.cumsum(lengths.sum(axis=1))}
+    timings.count("seed cells", sweep["seed"].sum())
+    timings.count("pair distances", sweep["pair_total"][-1])
+    return sweep
+
+
+def sweep_pairs(sweep, config, timings=None):
+    """Measure the cell pairs of a sweep set up by grid_sweep, in blocks of 
+    around 4 million pairs.  Yields, for each block, the sweep positions of 
+    the two cells of every pair within range, the distance bin of each pair 
+    (see bin_index) and its squared distance.  The pairs within range are 
+    counted in timings."""
+    if timings is None:
+        timings = Timings()
+    bins = config.bins
+    x, y, z = sweep["x"], sweep["y"], sweep["z"]
+    starts, lengths = sweep["starts"], sweep["lengths"]
+    pair_total = sweep["pair_total"]
+    block = 2 ** 22
+    edges = np.unique(np.r_[0, np.searchsorted(
+        pair_total, np.arange(block, pair_total[-1], block)), len(x)])
+    for first_cell, last_cell in zip(edges[:-1], edges[1:]):
+        cells = slice(first_cell, last_cell)
+        block_lengths = lengths[cells].ravel()
+        offsets = np.cumsum(block_lengths) - block_lengths
+        second = (np.arange(block_lengths.sum()) + 
+                  np.repeat(starts[cells].ravel() - offsets, block_lengths))
+        cell_lengths = lengths[cells].sum(axis=1)
+        dist_squared = np.repeat(x[cells], cell_lengths)
+        dist_squared -= x[second]
+        dist_squared *= dist_squared
+        y_diff = np.repeat(y[cells], cell_lengths)
+        y_diff -= y[second]
+        y_diff *= y_diff
+        dist_squared += y_diff
+        if z is not None:
+            z_diff = np.repeat(z[cells], cell_lengths)
+            z_diff -= z[second]
+            z_diff *= z_diff
+            dist_squared += z_diff
+        # Most candidate pairs are out of range; drop them before binning
+        near = np.flatnonzero(dist_squared < bins ** 2)
+        array_target = bin_index(dist_squared[near], config)
+        counted = near[array_target >= 0]
+        first = np.repeat(np.arange(first_cell, last_cell), 
+                          cell_lengths)[counted]
+        timings.count("pairs in range", len(first))
+        yield (first, second[counted], array_target[array_target >= 0], 
+               dist_squared[counted])
+
+
+def edge_weights(x_diff, y_diff, bounds, config):
+    """Weights of cell pairs x_diff and y_diff apart for the edge correction 
+    config.edge_correction, in an ROI with bounds (xmin, xmax, ymin, ymax).  
+    The "translation" correction weighs each pair by the ROI's area over 
+    the area it shares with a copy of itself moved by the pair's offset: 
+    the inverse of the chance that a pair so placed, put anywhere at 
+    random, falls wholly inside the ROI.  Pairs near the boundary, which 
+    are the likeliest to be cut off, so count for more.  The ROI has to be 
+    wider and taller than analysis_dist + 1.  The correction is 2-D only."""
+    if config.use_z:
+        raise ValueError("The edge correction cannot be used in a 3-D "
+                         "analysis (use_z)")
+    if config.edge_correction != "translation":
+        raise ValueError("Unknown edge correction: %r" % 
+                         (config.edge_correction,))
+    xmin, xmax, ymin, ymax = bounds
+    width, height = xmax - xmin, ymax - ymin
+    if min(width, height) <= config.bins:
+        raise ValueError("The translation edge correction needs an ROI "
+                         "wider and taller than analysis_dist + 1")
+    return (width * height / 
+            ((width - np.abs(x_diff)) * (height - np.abs(y_diff))))
+
+
+def tile_cells(sp_data, types, config, chunk_cells=2 ** 20):
+    """Split the ROI of sp_data into square tiles config.tile_size um wide, 
+    each with a halo one analysis range wide around it, for the cells of 
+    the cell types in types (sorted, no repeats).  Yields, for each tile 
+    holding a seed cell, the indices into sp_data of the cells in the tile 
+    or its halo, in order, and a mask of those in the tile itself.  The 
+    tiles are found a row at a time, each row in one pass over the type 
+    and y columns that reads them chunk_cells cells at a time, so columns 
+    memory-mapped from the cache are never read in whole."""
+    if sp_data.bounds is not None:
+        xmin, xmax, ymin, ymax = sp_data.bounds
+    else:
+        xmin, xmax = float(sp_data.x.min()), float(sp_data.x.max())
+        ymin, ymax = float(sp_data.y.min()), float(sp_data.y.max())
+    size, halo = float(config.tile_size), config.bins
+    columns = max(1, int(math.ceil((xmax - xmin) / size)))
+    rows = max(1, int(math.ceil((ymax - ymin) / size)))
+    for row in range(rows):
+        low, high = ymin + row * size - halo, ymin + (row + 1) * size + halo
+        pieces = []
+        for start in range(0, len(sp_data), chunk_cells):
+            piece = slice(start, start + chunk_cells)
+            y = sp_data.y[piece]
+            pieces.append(start + np.flatnonzero(
+                (y >= low) & (y <= high) & np.isin(sp_data.type[piece], 
+                                                   types)))
+        strip = np.concatenate(pieces)
+        x, y = sp_data.x[strip], sp_data.y[strip]
+        tile_column = np.minimum(np.floor((x - xmin) / size), columns - 1)
+        in_row = np.minimum(np.floor((y - ymin) / size), rows - 1) == row
+        for column in range(columns):
+            near = ((x >= xmin + column * size - halo) & 
+                    (x <= xmin + (column + 1) * size + halo))
+            own = (in_row & (tile_column == column))[near]
+            cells = strip[near]
+            if (sp_data.seed[cells] & own).any():
+                yield cells, own
+
+
+def pair_counts(sp_data, types, config, seed_key=None, key_count=1, 
+                edge_counts=False, timings=None):
+    """Count the cell pairs in each distance bin for every ordered pair of 
+    the cell types in types (sorted, no repeats) in one sweep of 
+    grid_sweep, crediting each pair to whichever of its two cells is a seed 
+    cell.  The counts go into a (seed type, cell type, seed key, bin) 
+    tensor of bin counts, not yet cumulative.  seed_key optionally splits 
+    the seed cells into key_count groups: it is an integer array giving the 
+    group of each cell of sp_data, and is only read for seed cells.  With 
+    edge_counts, the tensor gets a further axis of length 2 before the 
+    bins: the pair counts, then the number of those pairs whose squared 
+    distance is not below the square of their bin's upper distance, which a 
+    range ending at that distance leaves out.  The number of seed cells, 
+    pair distances measured and pairs within range are counted in timings.  
+    With config.edge_correction, each pair counts for its weight from 
+    edge_weights, and the tensor holds floats.  With config.use_jit, the 
+    pairs are counted by the compiled loop in kernels if Numba is installed 
+    (without an edge correction).  With config.tile_size, the pairs of each 
+    tile from tile_cells are counted on their own, crediting only the seed 
+    cells in the tile, and the tiles' counts are added up; each pair is 
+    still counted exactly once for each of its seed cells.  The integer 
+    counts are those of the whole ROI, but the float sums of an edge 
+    correction are added in another order and may differ in the last 
+    digits."""
+    if timings is None:
+        timings = Timings()
+    bins = config.bins
+    type_count = len(types)
+    layers = 2 if edge_counts else 1
+    weighted = config.edge_correction is not None
+    counts = np.zeros(type_count * type_count * key_count * layers * bins, 
+                      dtype=float if weighted else np.int64)
+    if config.tile_size is None:
+        sweep = grid_sweep(sp_data, types, config, timings)
+    else:
+        sweep = None
+        untiled = config.replace(tile_size=None)
+        for cells, own in tile_cells(sp_data, types, config):
+            tile = CellTable.from_sorted(
+                sp_data.type[cells], sp_data.x[cells], sp_data.y[cells], 
+                sp_data.layer[cells], 
+                None if sp_data.z is None else sp_data.z[cells])
+            tile.seed = sp_data.seed[cells] & own
+            tile.bounds, tile.zbounds = sp_data.bounds, sp_data.zbounds
+            counts += pair_counts(
+                tile, types, untiled, 
+                None if seed_key is None else np.asarray(seed_key)[cells], 
+                key_count, edge_counts, timings).ravel()
+    if sweep is not None:
+        type_idx, seed = sweep["type_idx"], sweep["seed"]
+        if seed_key is None:
+            seed_key = np.zeros(len(seed), dtype=np.int64)
+        else:
+            seed_key = np.asarray(seed_key)[sweep["cells"]]
+    if (sweep is not None and config.use_jit and kernels.usable() and 
+            not weighted):
+        # The kernel takes an empty z array for 2-D data
+        z = np.zeros(0) if sweep["z"] is None else sweep["z"]
+        jit_counts, in_range = kernels.count_pairs(
+            sweep["x"], sweep["y"], z, type_idx, seed, seed_key, 
+            sweep["starts"], sweep["stops"], type_count, key_count, layers, 
+            config.analysis_dist, config.interval_num, 
+            kernels.chunk_count(len(seed)))
+        counts += jit_counts
+        timings.count("pairs in range", in_range)
+    elif sweep is not None:
+        for first, second, array_target, dist_squared in sweep_pairs(
+                sweep, config, timings):
+            if edge_counts:
+                on_edge = dist_squared >= (array_target * config.interval_num 
+                                           / config.analysis_dist) ** 2
+            weights = None
+            if weighted:
+                weights = edge_weights(sweep["x"][first] - sweep["x"][second], 
+                                       sweep["y"][first] - sweep["y"][second], 
+                                       sp_data.bounds, config)
+            for seed_cell, other_cell in ((first, second), (second, first)):
+                credit = seed[seed_cell]
+                pair_target = (((type_idx[seed_cell[credit]] * type_count + 
+                                 type_idx[other_cell[credit]]) * key_count + 
+                                seed_key[seed_cell[credit]]) * layers * bins + 
+                               array_target[credit])
+                pair_weights = None if weights is None else weights[credit]
+                counts += np.bincount(pair_target, pair_weights, 
+                                      minlength=len(counts))
+                if edge_counts:
+                    counts += np.bincount(
+                        pair_target[on_edge[credit]] + bins, 
+                        None if weights is None 
+                        else pair_weights[on_edge[credit]], 
+                        minlength=len(counts))
+    counts = counts.reshape(type_count, type_count, key_count, layers, bins)
+    return counts if edge_counts else counts[:, :, :, 0]
+
+
+def neighbor_pairs(sp_data, types, config, timings=None):
+    """List every cell pair within range among the cells of the cell types 
+    in types (sorted, no repeats), once for each of its cells that is a 
+    seed cell.  Output is four arrays: the seed cell and the other cell of 
+    each pair, as indices into sp_data, the distance bin of the pair, and 
+    its weight from edge_weights (None without config.edge_correction).  
+    The work done is counted in timings (see grid_sweep)."""
+    seed_cells, other_cells, targets, weights = [], [], [], []
+    sweep = grid_sweep(sp_data, types, config, timings)
+    if sweep is not None:
+        cells, seed = sweep["cells"], sweep["seed"]
+        for first, second, array_target, dist_squared in sweep_pairs(
+                sweep, config, timings):
+            if config.edge_correction is not None:
+                pair_weights = edge_weights(
+                    sweep["x"][first] - sweep["x"][second], 
+                    sweep["y"][first] - sweep["y"][second], sp_data.bounds, 
+                    config)
+            for seed_cell, other_cell in ((first, second), (second, first)):
+                credit = seed[seed_cell]
+                seed_cells.append(cells[seed_cell[credit]])
+                other_cells.append(cells[other_cell[credit]])
+                targets.append(array_target[credit])
+                if config.edge_correction is not None:
+                    weights.append(pair_weights[credit])
+    columns = [np.concatenate(column + [np.zeros(0, dtype=np.int64)]) 
+               for column in (seed_cells, other_cells, targets)]
+    if config.edge_correction is None:
+        return tuple(columns) + (None,)
+    return tuple(columns) + (np.concatenate(weights + [np.zeros(0)]),)
+
+
+def cluster_average(cluster1, cluster2):
+    """ Average together the results of the two runs (one from the 
+    "perspective" of each cell type)."""
+    return (np.asarray(cluster1, dtype=float) + 
+            np.asarray(cluster2, dtype=float)) / 2
+
+
+def pair_curves(tensor, types, pairs):
+    """Clustering values of every (celltype1, celltype2) pair in pairs from 
+    a (seed type, cell type, bin) tensor of clustering values for the cell 
+    types in types, or any array of them stacked along leading axes, 
+    averaging the two directions when the cell types differ.  Output has a 
+    row for each pair in place of the two cell type axes."""
+    curves = []
+    for celltype1, celltype2 in pairs:
+        first, second = types.index(celltype1), types.index(celltype2)
+        if first == second:
+            curves.append(tensor[..., first, first, :])
+        else:
+            curves.append(cluster_average(tensor[..., first, second, :], 
+                                          tensor[..., second, first, :]))
+    return np.stack(curves, axis=-2)
+
+
+def cluster_layout(sp_data, celltype1, celltype2, config):
+    """Generate the clustering values for one real or simulated CellTable, 
+    averaging the two directions when the cell types differ."""
+    if celltype1 == celltype2:
+        return cluster(sp_data, celltype1, celltype1, config)
+    return cluster_average(cluster(sp_data, celltype1, celltype2, config), 
+                           cluster(sp_data, celltype2, celltype1, config))
+
+
+def cluster_pairs(sp_data, pairs, config, timings=None):
+    """Generate the clustering values of one real or simulated CellTable for 
+    every (celltype1, celltype2) pair in pairs, as cluster_layout gives 
+    them.  With the grid engine, config.edge_correction or config.use_z, 
+    all pairs come from a single cluster_tensor sweep; the other engines 
+    run cluster_layout for each pair.  Output is an array with one row per 
+    pair.  The work done is counted in timings 
+    (see pair_counts)."""
+    if timings is None:
+        timings = Timings()
+    types = sorted(set(celltype for pair in pairs for celltype in pair))
+    if (config.engine != "grid" and config.edge_correction is None and 
+            not config.use_z):
+        timings.count("seed cells", np.sum(np.isin(sp_data.type, types) & 
+                                           sp_data.seed))
+        for celltype1, celltype2 in pairs:
+            for seed_type, other_type in set([(celltype1, celltype2), 
+                                              (celltype2, celltype1)]):
+                timings.count("pair distances", 
+                              np.sum(sp_data.seed[sp_data.type == 
+                                                  seed_type]) * 
+                              np.sum(sp_data.type == other_type))
+        return np.array([cluster_layout(sp_data, celltype1, celltype2, 
+                                        config) 
+                         for celltype1, celltype2 in pairs]).reshape(
+                             -1, config.bins)
+    return pair_curves(cluster_tensor(sp_data, types, config, timings), 
+                       types, pairs)
@@ -0,0 +1,266 @@
+"""Stores of per-seed distance histograms, so that an analysis can be 
+repeated with coarser bins, a shorter analysis range or a larger 
+exclude_dist without measuring any distances again.  A store holds, for the 
+real data and for each simulation run, the number of cell pairs in each of 
+the finest distance bins, split by the type of both cells and by how far 
+the seed cell is from the ROI boundary (in whole micrometers, up to 
+histogram_max_exclude).  Any analysis whose bins are whole multiples of the 
+store's, whose range is within the store's and whose exclude_dist is 
+between the store's and histogram_max_exclude is found by adding up the 
+right counts, and gives the same values as running it in full.  A store is 
+started by the first analysis of a data set and cell types, with that 
+analysis's settings, so it should have the finest bins, the largest range 
+and the smallest exclude_dist wanted."""
+from __future__ import absolute_import, division
+
+import hashlib
+import json
+import os
+import warnings
+
+import numpy as np
+
+from spatialpattern.cells import edge_distance
+from spatialpattern.engines import pair_counts, pair_curves
+
+# Bump this whenever the layout of a store changes, so old stores are 
+# rebuilt rather than misread.
+HISTOGRAM_VERSION = 1
+
+# The settings a store's histograms were made with.
+STORE_SETTINGS = ("analysis_dist", "interval_num", "exclude_dist", 
+                  "histogram_max_exclude")
+
+
+def max_exclude(config):
+    """Largest exclude_dist that the histograms made with config can be 
+    used for."""
+    if config.histogram_max_exclude is None:
+        return config.exclude_dist
+    return config.histogram_max_exclude
+
+
+def key_count(config):
+    """Number of edge distance groups the seed cells are split into."""
+    return int(max_exclude(config) - config.exclude_dist) + 1
+
+
+def check_histogram_config(config):
+    """Raise ValueError if histograms cannot be made with config."""
+    if config.edge_correction is not None:
+        raise ValueError("Histograms cannot be made with an edge_correction")
+    if config.use_z:
+        raise ValueError("Histograms cannot be made in a 3-D analysis "
+                         "(use_z)")
+    for name, value in (("exclude_dist", config.exclude_dist), 
+                        ("histogram_max_exclude", max_exclude(config))):
+        if value != int(value):
+            raise ValueError("Histograms need %s to be a whole number" % 
+                             name)
+    if max_exclude(config) < config.exclude_dist:
+        raise ValueError("histogram_max_exclude must be at least "
+                         "exclude_dist")
+
+
+def seed_keys(sp_data, config):
+    """Edge distance group of each seed cell of a real or simulated 
+    CellTable: 0 for seed cells no more than exclude_dist + 1 from the ROI 
+    boundary, 1 for those no more than exclude_dist + 2, and so on, with 
+    every cell farther than histogram_max_exclude in the last group.  A 
+    seed cell is in groups up to k exactly when exclude_dist + k does not 
+    exclude it.  Values for cells that are not seed cells are meaningless."""
+    xmin, xmax, ymin, ymax = sp_data.bounds
+    distance = np.ceil(edge_distance(sp_data.x, sp_data.y, xmin, xmax, ymin, 
+                                     ymax))
+    return (np.minimum(distance, max_exclude(config) + 1) - 
+            (config.exclude_dist + 1)).astype(np.int64)
+
+
+def pair_histograms(sp_data, types, config, timings=None):
+    """Histograms of one real or simulated CellTable: a (seed type, cell 
+    type, edge distance group, 2, bin) array of cell pair counts for the 
+    cell types in types (sorted, no repeats), with the seed cells marked in 
+    sp_data at config.exclude_dist.  The pairs on the upper edge of each bin 
+    are counted again after the pairs themselves (see 
+    engines.pair_counts).  The work done is counted in timings."""
+    return pair_counts(sp_data, types, config, seed_keys(sp_data, config), 
+                       key_count(config), True, timings)
+
+
+class HistogramStore(object):
+    """The histograms of the real data and of every simulation run made so 
+    far for one data set and set of cell types.  config holds the settings 
+    the histograms were made with, raw the histograms of the real data, and 
+    sims those of the simulation runs, in run order, all drawn from 
+    base_seed (None until the first run)."""
+
+    def __init__(self, path, types, config, raw, base_seed=None, sims=(), 
+                 saved=False):
+        self.path = path
+        self.types = list(types)
+        self.config = config
+        self.raw = raw
+        self.base_seed = base_seed
+        self.sims = list(sims)
+        self.saved = saved
+
+    @property
+    def runs(self):
+        """Number of simulation runs stored."""
+        return len(self.sims)
+
+    def derivable(self, config):
+        """Whether the clustering values of an analysis with config can be 
+        found from these histograms: its bins are a whole number of the 
+        store's bins wide, its range is within the store's and ends on the 
+        edge of one of the store's bins, and its exclude_dist is one the 
+        store was made for.  The range ends at interval_num, or just short 
+        of analysis_dist + 1 if that is nearer."""
+        store = self.config
+        exclude_dist = config.exclude_dist
+        if (config.edge_correction is not None or config.use_z or 
+                exclude_dist != int(exclude_dist) or 
+                exclude_dist < store.exclude_dist or 
+                exclude_dist > max_exclude(store) or 
+                config.interval_num * store.analysis_dist % 
+                (store.interval_num * config.analysis_dist)):
+            return False
+        if config.interval_num <= config.analysis_dist:
+            return config.interval_num <= store.interval_num
+        return (config.bins <= store.interval_num and 
+                config.bins * store.analysis_dist % store.interval_num == 0)
+
+    def curves(self, histograms, pairs, config):
+        """Clustering values of every (celltype1, celltype2) pair in pairs 
+        for an analysis with config, from one set of histograms (raw or one 
+        of sims) or any array of them stacked along leading axes.  Only the 
+        seed cells config.exclude_dist leaves in are counted, and the 
+        cumulative counts are read off at the edges of config's bins.  The 
+        values are those cluster_pairs gives, with the same shape."""
+        store = self.config
+        step = (config.interval_num * store.analysis_dist // 
+                (store.interval_num * config.analysis_dist))
+        counts = histograms[..., int(config.exclude_dist - 
+                                     store.exclude_dist):, :, :].sum(axis=-3)
+        cumulative = np.cumsum(counts[..., 0, :], axis=-1)
+        # The store's bin ending where each of config's bins ends
+        edges = step * np.arange(config.bins)
+        if config.interval_num > config.analysis_dist:
+            # Pairs config.bins or more apart are left out, so the last bins 
+            # hold every pair closer than that.
+            end = config.bins * store.analysis_dist // store.interval_num
+            closer = cumulative[..., end] - counts[..., 1, end]
+            tensor = np.where(edges < end, 
+                              cumulative[..., np.minimum(edges, end)], 
+                              closer[..., np.newaxis])
+        else:
+            tensor = cumulative[..., edges]
+        return pair_curves(tensor.astype(float), self.types, pairs)
+
+    def use_seed(self, base_seed):
+        """Set the base seed of the simulation runs, dropping the stored runs 
+        if they were drawn from another one."""
+        if base_seed != self.base_seed:
+            self.base_seed = base_seed
+            self.sims = []
+            self.saved = False
+
+    def sim_curves(self, first_run, new_runs, pairs, config):
+        """Clustering values of the simulation runs from run first_run on, 
+        as curves gives them, up to config.sim_run_num runs.  The stored 
+        runs are used first; after them come new_runs, histograms of the 
+        runs that follow the stored ones, which are added to the store as 
+        they are used."""
+        for run in range(first_run, min(self.runs, config.sim_run_num)):
+            yield self.curves(self.sims[run], pairs, config)
+        for histograms in new_runs:
+            self.sims.append(histograms)
+            self.saved = False
+            if self.runs > first_run:
+                yield self.curves(histograms, pairs, config)
+
+
+def histogram_path(prepared, types, config):
+    """Directory of the histogram store for some cell types of a prepared 
+    data set, in config.histogram_dir.  The name is a hash of the cells, the 
+    ROI, the layer bands and the cell types, which together fix the pair 
+    distances of the real data and of every simulation run."""
+    digest = hashlib.sha1()
+    sp_data_mod = prepared.sp_data_mod
+    for column in (sp_data_mod.type, sp_data_mod.x, sp_data_mod.y, 
+                   sp_data_mod.layer):
+        digest.update(column.tobytes())
+    digest.update(repr((tuple(prepared[1:]), list(types), 
+                        config.layers)).encode("utf-8"))
+    return os.path.join(config.histogram_dir, "hist_" + digest.hexdigest())
+
+
+def load_histograms(path, config):
+    """Read a histogram store.  config is the analysis's settings, into 
+    which the store's own are put.  Output is a HistogramStore, or None if 
+    there is no store of this version."""
+    try:
+        with open(os.path.join(path, "meta.json")) as meta_file:
+            meta = json.load(meta_file)
+    except (IOError, OSError, ValueError):
+        return None
+    if meta.get("version") != HISTOGRAM_VERSION:
+        return None
+    raw = np.load(os.path.join(path, "raw.npy"))
+    sims = np.load(os.path.join(path, "sims.npy"))
+    return HistogramStore(path, meta["types"], 
+                          config.replace(**meta["settings"]), raw, 
+                          meta["base_seed"], sims, saved=True)
+
+
+def save_histograms(store):
+    """Save a histogram store, unless it is unchanged since it was last 
+    read or saved.  The metadata file is removed first and written last, so 
+    a store that was only partly written is never used."""
+    if store.saved:
+        return
+    meta_path = os.path.join(store.path, "meta.json")
+    if not os.path.isdir(store.path):
+        os.makedirs(store.path)
+    elif os.path.exists(meta_path):
+        os.remove(meta_path)
+    sims = np.array(store.sims, dtype=np.int64).reshape(
+        (store.runs,) + store.raw.shape)
+    for name, counts in (("raw", store.raw), ("sims", sims)):
+        # Counts that fit are saved as 32-bit integers, to halve the size
+        if not counts.size or counts.max() < 2 ** 31:
+            counts = counts.astype(np.int32)
+        np.save(os.path.join(store.path, name + ".npy"), counts)
+    meta = {"version": HISTOGRAM_VERSION, "types": store.types, 
+            "settings": dict((name, getattr(store.config, name)) 
+                             for name in STORE_SETTINGS), 
+            "base_seed": store.base_seed, "runs": store.runs}
+    with open(meta_path, "w") as meta_file:
+        json.dump(meta, meta_file)
+    store.saved = True
+
+
+def open_histograms(prepared, pairs, config, timings=None):
+    """The histogram store for the cell type pairs of a prepared data set, 
+    read from config.histogram_dir if one there can be used for config 
+    (see HistogramStore.derivable).  Otherwise a new store is started with 
+    config's own settings, holding the histograms of the real data; it 
+    replaces any store of the same data set once saved.  A store cannot be 
+    started by an analysis with interval_num larger than analysis_dist, so 
+    if no stored one can be used for it, the output is None, with a 
+    warning, and the analysis is run in full without a store."""
+    types = sorted(set(celltype for pair in pairs for celltype in pair))
+    path = histogram_path(prepared, types, config)
+    store = load_histograms(path, config)
+    if store is not None and store.derivable(config):
+        return store
+    if config.interval_num > config.analysis_dist:
+        warnings.warn("No stored histograms fit this analysis, and none "
+                      "can be started with interval_num larger than "
+                      "analysis_dist, so it is run in full without them")
+        return None
+    check_histogram_config(config)
+    store_config = config.replace(histogram_max_exclude=max_exclude(config))
+    return HistogramStore(path, types, store_config, 
+                          pair_histograms(prepared.sp_data_mod, types, 
+                                          store_config, timings))
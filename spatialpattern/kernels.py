@@ -0,0 +1,105 @@
+"""Compiled version of the pair counting loop of engines.pair_counts, used 
+when the Numba library is installed (and Config.use_jit is set).  It walks 
+the same cell pairs as the NumPy version and bins them with the same 
+arithmetic, so the counts are identical, but it needs no temporary arrays 
+and runs on every core.  Without Numba, AVAILABLE is False and the NumPy 
+version is used."""
+from __future__ import absolute_import, division
+
+import math
+import os
+import threading
+
+import numpy as np
+
+try:
+    import numba
+except ImportError:
+    numba = None
+
+AVAILABLE = numba is not None
+
+# Numba's thread pools are not all safe to enter from two threads at once 
+# (its own "workqueue" pool aborts the process), so the kernel is run by 
+# one thread at a time; it uses every core anyway.
+LOCK = threading.Lock()
+
+# Process the kernel was last run in.  The TBB and OpenMP thread pools hang 
+# in a process forked from one that has started them.
+RAN_IN = None
+
+
+def usable():
+    """True if the kernel can be run in this process: Numba is installed, 
+    and this is not a process forked from one that has run the kernel 
+    (see shared.worker_pool, which avoids forking where it can)."""
+    return AVAILABLE and RAN_IN in (None, os.getpid())
+
+
+def count_pairs(*args):
+    """Run pair_kernel, one thread at a time.  The arguments and output are 
+    those of pair_kernel."""
+    global RAN_IN
+    with LOCK:
+        RAN_IN = os.getpid()
+        return pair_kernel(*args)
+
+
+def chunk_count(cells):
+    """Number of pieces to split the cells into: a few per thread, so that 
+    the threads stay busy when some pieces have more pairs than others."""
+    return max(1, min(cells, 4 * numba.get_num_threads()))
+
+
+if AVAILABLE:
+    @numba.njit(parallel=True, cache=True)
+    def pair_kernel(x, y, z, type_idx, seed, seed_key, starts, stops, 
+                    type_count, key_count, layers, analysis_dist, 
+                    interval_num, chunks):
+        """Count the cell pairs as engines.pair_counts does.  starts and 
+        stops give, for each cell, the slices of later cells to compare it 
+        with.  z is empty for 2-D data.  Output is the flat count tensor and 
+        the number of pairs within range."""
+        bins = analysis_dist + 1
+        cells = len(x)
+        size = type_count * type_count * key_count * layers * bins
+        counts = np.zeros((chunks, size), dtype=np.int64)
+        in_range = np.zeros(chunks, dtype=np.int64)
+        for chunk in numba.prange(chunks):
+            for first in range(chunk * cells // chunks, 
+                               (chunk + 1) * cells // chunks):
+                for part in range(starts.shape[1]):
+                    for second in range(starts[first, part], 
+                                        stops[first, part]):
+                        x_diff = x[first] - x[second]
+                        y_diff = y[first] - y[second]
+                        dist_squared = x_diff * x_diff + y_diff * y_diff
+                        if len(z):
+                            z_diff = z[first] - z[second]
+                            dist_squared += z_diff * z_diff
+                        if dist_squared <= 0 or dist_squared >= bins * bins:
+                            continue
+                        target = math.ceil(math.sqrt(dist_squared) * 
+                                           (bins - 1) / interval_num)
+                        if target >= bins:
+                            continue
+                        in_range[chunk] += 1
+                        on_edge = False
+                        if layers == 2:
+                            edge = target * interval_num / analysis_dist
+                            on_edge = dist_squared >= edge * edge
+                        for side in range(2):
+                            seed_cell = first if side == 0 else second
+                            other_cell = second if side == 0 else first
+                            if not seed[seed_cell]:
+                                continue
+                            pair_target = (((type_idx[seed_cell] * 
+                                             type_count + 
+                                             type_idx[other_cell]) * 
+                                            key_count + 
+                                            seed_key[seed_cell]) * layers * 
+                                           bins + target)
+                            counts[chunk, pair_target] += 1
+                            if on_edge:
+                                counts[chunk, pair_target + bins] += 1
+        return counts.sum(axis=0), in_range.sum()
@@ -0,0 +1,147 @@
+"""Hand the cells and other large arrays to worker processes through 
+memory-mapped files.  SharedFiles.publish saves each large array of a value 
+(such as the simulation inputs) to a file once and puts a small 
+MappedArray handle in its place, so that sending the value to a worker 
+costs a few bytes per array.  attach, called in the worker, maps the files 
+back in read-only, so every worker reads the one copy held in the operating 
+system's page cache rather than keeping its own.  Arrays that are already 
+memory-mapped from a whole file, such as the columns of the binary cache, 
+are handed on as they are, without being written again.  The worker 
+processes themselves are started by worker_pool."""
+from __future__ import absolute_import, division
+
+import mmap
+import multiprocessing
+import os
+import shutil
+import tempfile
+
+import numpy as np
+
+from spatialpattern import kernels
+from spatialpattern.cells import CellTable
+
+# Arrays smaller than this are sent to the workers as they are
+MIN_PUBLISHED_BYTES = 2 ** 16
+
+
+class MappedArray(object):
+    """Handle to an array saved in a file: the file path, the dtype, the 
+    shape and the offset of the data in the file."""
+
+    def __init__(self, path, dtype, shape, offset):
+        self.path = path
+        self.dtype = dtype
+        self.shape = shape
+        self.offset = offset
+
+    def open(self):
+        """Memory-map the array, read-only."""
+        return np.memmap(self.path, dtype=self.dtype, mode="r", 
+                         offset=self.offset, shape=self.shape)
+
+
+class SharedFiles(object):
+    """Temporary directory of published arrays.  It is made when the first 
+    array is published and removed by close."""
+
+    def __init__(self):
+        self.directory = None
+        self.count = 0
+
+    def publish_array(self, array):
+        """MappedArray handle to array, saving it if it is not already 
+        memory-mapped from a whole file; small arrays are returned as they 
+        are."""
+        if array.nbytes < MIN_PUBLISHED_BYTES or array.dtype.hasobject:
+            return array
+        if (isinstance(array, np.memmap) and 
+                isinstance(array.base, mmap.mmap) and array.filename):
+            return MappedArray(array.filename, array.dtype.str, array.shape, 
+                               array.offset)
+        if self.directory is None:
+            self.directory = tempfile.mkdtemp(prefix="spatialpattern_")
+        path = os.path.join(self.directory, "array%d.npy" % self.count)
+        self.count += 1
+        np.save(path, np.ascontiguousarray(array))
+        saved = np.load(path, mmap_mode="r")
+        handle = MappedArray(path, saved.dtype.str, saved.shape, saved.offset)
+        del saved
+        return handle
+
+    def publish(self, value):
+        """Copy of value with every large array in it published.  Arrays 
+        are found in tuples (named or not), lists and CellTables; anything 
+        else is left as it is."""
+        if isinstance(value, np.ndarray):
+            return self.publish_array(value)
+        if isinstance(value, CellTable):
+            published = CellTable.__new__(CellTable)
+            published.__dict__.update((name, self.publish(column)) 
+                                      for name, column 
+                                      in value.__dict__.items())
+            return published
+        if isinstance(value, tuple) and hasattr(value, "_fields"):
+            return type(value)(*[self.publish(item) for item in value])
+        if isinstance(value, (tuple, list)):
+            return type(value)(self.publish(item) for item in value)
+        return value
+
+    def close(self):
+        """Remove the published files.  Call it once no worker uses them; 
+        files still mapped (as on Windows, until the workers exit) may be 
+        left behind."""
+        if self.directory is not None:
+            shutil.rmtree(self.directory, ignore_errors=True)
+            self.directory = None
+
+
+def attach(value):
+    """Undo SharedFiles.publish in a worker process: a copy of value with 
+    every MappedArray handle memory-mapped.  Values that were never 
+    published come back unchanged."""
+    if isinstance(value, MappedArray):
+        return value.open()
+    if isinstance(value, CellTable):
+        attached = CellTable.__new__(CellTable)
+        attached.__dict__.update((name, attach(column)) 
+                                 for name, column in value.__dict__.items())
+        return attached
+    if isinstance(value, tuple) and hasattr(value, "_fields"):
+        return type(value)(*[attach(item) for item in value])
+    if isinstance(value, (tuple, list)):
+        return type(value)(attach(item) for item in value)
+    return value
+
+
+def worker_pool(workers, initializer=None, initargs=(), 
+                maxtasksperchild=None):
+    """Pool of workers worker processes.  Once the compiled kernel has run 
+    in this process, its thread pool would hang in a forked copy, so the 
+    workers are then started by a fork server (or spawned, where there is 
+    none) instead of being forked; like any spawned process, they import 
+    the main script, which must keep its work under 
+    `if __name__ == "__main__":`.  Python 2 can only fork; its workers then 
+    count pairs without the kernel (see kernels.usable)."""
+    context = multiprocessing
+    if (kernels.RAN_IN == os.getpid() and 
+            hasattr(multiprocessing, "get_context")):
+        methods = multiprocessing.get_all_start_methods()
+        context = multiprocessing.get_context(
+            "forkserver" if "forkserver" in methods else "spawn")
+    return context.Pool(workers, worker_start, (initializer, initargs), 
+                        maxtasksperchild)
+
+
+def worker_start(initializer, initargs):
+    """Start a worker process of worker_pool, then call initializer with 
+    initargs, if given.  A worker that was not forked is set to fork any 
+    processes of its own.  It starts none, but Numba then makes the lock 
+    it keeps for them in a way that needs no cleanup, which a worker 
+    stopped by Pool.terminate would never do."""
+    if (hasattr(multiprocessing, "get_start_method") and 
+            multiprocessing.get_start_method() != "fork" and 
+            "fork" in multiprocessing.get_all_start_methods()):
+        multiprocessing.set_start_method("fork", force=True)
+    if initializer is not None:
+        initializer(*initargs)
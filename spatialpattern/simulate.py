@@ -0,0 +1,306 @@
+"""Simulated null models.  The positional null model simulates the cell 
+distribution with random, layer-stratified cell locations.  The random 
+labelling null model keeps every cell where it is and shuffles the cell 
+types of each analyzed pair among the cells of those types, within each 
+layer when the data has layers; since no distance changes, the cell pairs 
+within range are listed once (see engines.neighbor_pairs) and every run 
+only counts them again under its own labels.  In a 3-D analysis 
+(Config.use_z) the positional null model also spreads the cells uniformly 
+through the depth of the section."""
+from __future__ import absolute_import, division
+
+import itertools
+import multiprocessing
+import random
+
+import numpy as np
+
+from spatialpattern.cells import edge_mask, slab_mask
+from spatialpattern.checkpoint import load_checkpoint, save_checkpoint
+from spatialpattern.engines import (cluster_pairs, neighbor_pairs, 
+                                    pair_curves)
+from spatialpattern.histogram import key_count, pair_histograms
+from spatialpattern.shared import SharedFiles, attach, worker_pool
+from spatialpattern.stats import SimStats
+from spatialpattern.timing import Timings
+
+
+def new_seed():
+    """Pick a base seed for a set of simulations when none is given."""
+    return random.SystemRandom().randint(0, 2 ** 31 - 1)
+
+
+def sim_seed(base_seed, runcount):
+    """Seed for one simulation run.  Each run gets its own seed so that its 
+    result does not depend on which process ran it or in what order."""
+    return [base_seed, runcount]
+
+
+def sim_gen(sp_data, runcounts, base_seed, xmin, xmax, ymin, ymax, 
+            ybound_list, config):
+    """Make simulated versions of the cell distribution with random 
+    locations, one for each run number in runcounts.  Output is an array of 
+    shape (runs, cells, 2) holding the simulated x and y coordinates of 
+    every cell of sp_data in every run.  With config.use_z it has shape 
+    (runs, cells, 3), the third column holding z coordinates drawn 
+    uniformly between the zbounds of sp_data."""
+    if config.layers:
+        ybound_array = np.array([ybound[0:2] for ybound in ybound_list], 
+                                dtype=float)
+        ylow = ybound_array[sp_data.layer - 1, 1]
+        yhigh = ybound_array[sp_data.layer - 1, 0]
+    else:
+        ylow, yhigh = ymin, ymax
+    sim_xy = np.empty((len(runcounts), len(sp_data), 3 if config.use_z 
+                       else 2))
+    for run, runcount in enumerate(runcounts):
+        rng = np.random.RandomState(sim_seed(base_seed, runcount))
+        sim_xy[run, :, 0] = rng.uniform(xmin, xmax, len(sp_data))
+        sim_xy[run, :, 1] = rng.uniform(ylow, yhigh, len(sp_data))
+        if config.use_z:
+            sim_xy[run, :, 2] = rng.uniform(sp_data.zbounds[0], 
+                                            sp_data.zbounds[1], len(sp_data))
+    return sim_xy
+
+
+def sim_boundaries(sim_xy, xmin, xmax, ymin, ymax, exclude_dist, 
+                   zbounds=None, z_exclude_dist=None):
+    """Modified version of boundaries function so as not to reset boundaries 
+    smaller in simulation runs.  Output is a boolean array of shape (runs, 
+    cells) marking the simulated seed cells.  For 3-D layouts from sim_gen, 
+    the seed cells must also pass slab_mask within zbounds."""
+    seed = edge_mask(sim_xy[..., 0], sim_xy[..., 1], xmin, xmax, ymin, ymax, 
+                     exclude_dist)
+    if sim_xy.shape[-1] == 3:
+        seed &= slab_mask(sim_xy[..., 2], zbounds[0], zbounds[1], 
+                          z_exclude_dist)
+    return seed
+
+
+def label_gen(sp_data, types, shuffled, runcounts, base_seed, config):
+    """Make randomly labelled versions of the cell distribution, one for 
+    each run number in runcounts.  The cell types of the cells of the cell 
+    types in shuffled are shuffled among those cells, separately within 
+    each layer with config.layers; the cells of the other types in types 
+    (sorted, no repeats, holding those of shuffled) keep their own.  Output 
+    is an array of shape (runs, cells) holding the index in types of the 
+    simulated type of every cell of sp_data in every run; values for cells 
+    of types not in types are meaningless."""
+    cells = np.flatnonzero(np.isin(sp_data.type, shuffled))
+    if config.layers:
+        layer = sp_data.layer[cells]
+        groups = [cells[layer == number] for number in np.unique(layer)]
+    else:
+        groups = [cells]
+    type_idx = np.searchsorted(types, sp_data.type)
+    labels = np.empty((len(runcounts), len(sp_data)), dtype=np.int64)
+    for run, runcount in enumerate(runcounts):
+        rng = np.random.RandomState(sim_seed(base_seed, runcount))
+        labels[run] = type_idx
+        for group in groups:
+            labels[run, group] = type_idx[rng.permutation(group)]
+    return labels
+
+
+def label_clusters(neighbors, labels, types, pairs, config):
+    """Generate the clustering values of one randomly labelled version of 
+    the cell distribution for every (celltype1, celltype2) pair in pairs, 
+    as cluster_pairs gives them.  neighbors is the output of 
+    engines.neighbor_pairs for the cell types in types, and labels one row 
+    of the output of label_gen."""
+    seed_cells, other_cells, targets, weights = neighbors
+    type_count, bins = len(types), config.bins
+    pair_target = ((labels[seed_cells] * type_count + labels[other_cells]) * 
+                   bins + targets)
+    counts = np.bincount(pair_target, weights, minlength=type_count * 
+                         type_count * bins).reshape(type_count, type_count, 
+                                                    bins)
+    return pair_curves(np.cumsum(counts, axis=2).astype(float), types, pairs)
+
+
+def sim_block(sim_args, runcounts, timings=None):
+    """Generate and cluster a block of simulated cell distributions, all 
+    generated together by sim_gen.  sim_args holds everything the runs 
+    need, so that it can be sent to a worker process.  Output is an array 
+    of shape (runs, pairs, bins) with the clustering values of each run for 
+    each cell type pair, or, if sim_args holds a list of histogram types, 
+    the histograms of each run for those types (see 
+    histogram.pair_histograms).  If sim_args holds the cell pairs within 
+    range, the runs are randomly labelled instead (see label_gen): the cell 
+    types of each pair are shuffled among their own cells only, once for 
+    all the pairs of the same types, so that a pair's runs are those it 
+    would have if it were analyzed alone.  Each step is timed in 
+    timings."""
+    (sp_data_mod, pairs, xmin, xmax, ymin, ymax, ybound_list, base_seed, 
+     config, histogram_types, neighbors) = sim_args
+    if timings is None:
+        timings = Timings()
+    if neighbors is not None:
+        types = sorted(set(celltype for pair in pairs for celltype in pair))
+        sim_clusters = np.empty((len(runcounts), len(pairs), config.bins))
+        for shuffled in sorted(set(tuple(sorted(set(pair))) 
+                                   for pair in pairs)):
+            group = [number for number, pair in enumerate(pairs) 
+                     if tuple(sorted(set(pair))) == shuffled]
+            group_pairs = [pairs[number] for number in group]
+            with timings.stage("sim_gen"):
+                labels = label_gen(sp_data_mod, types, shuffled, runcounts, 
+                                   base_seed, config)
+            for run in range(len(runcounts)):
+                with timings.stage("sim_cluster"):
+                    sim_clusters[run, group] = label_clusters(
+                        neighbors, labels[run], types, group_pairs, config)
+        return sim_clusters
+    with timings.stage("sim_gen"):
+        sim_xy = sim_gen(sp_data_mod, runcounts, base_seed, xmin, xmax, ymin, 
+                         ymax, ybound_list, config)
+    with timings.stage("sim_boundaries"):
+        sim_seeds = sim_boundaries(sim_xy, xmin, xmax, ymin, ymax, 
+                                   config.seed_exclude, sp_data_mod.zbounds, 
+                                   config.z_exclude_dist)
+    if histogram_types is None:
+        sim_clusters = np.empty((len(runcounts), len(pairs), config.bins))
+    else:
+        type_count = len(histogram_types)
+        sim_clusters = np.empty((len(runcounts), type_count, type_count, 
+                                 key_count(config), 2, config.bins), 
+                                dtype=np.int64)
+    for run in range(len(runcounts)):
+        layout = sp_data_mod.relocate(
+            sim_xy[run, :, 0], sim_xy[run, :, 1], sim_seeds[run], 
+            sim_xy[run, :, 2] if config.use_z else None)
+        with timings.stage("sim_cluster"):
+            if histogram_types is None:
+                sim_clusters[run] = cluster_pairs(layout, pairs, config, 
+                                                  timings)
+            else:
+                sim_clusters[run] = pair_histograms(layout, histogram_types, 
+                                                    config, timings)
+    return sim_clusters
+
+
+def sim_worker_init(sim_args):
+    """Store the simulation inputs in a worker process once, rather than 
+    sending them along with every block of runs.  Their large arrays come 
+    as memory-mapped files (see shared.SharedFiles)."""
+    global worker_sim_args
+    worker_sim_args = attach(sim_args)
+
+
+def sim_worker_run(runcounts):
+    """Run one block of simulations in a worker process.  Output is the 
+    block's clustering values and the Timings of its steps."""
+    timings = Timings()
+    return sim_block(worker_sim_args, runcounts, timings), timings
+
+
+def merge_timings(block_results, timings):
+    """Pass on the clustering values of blocks run by sim_worker_run, adding 
+    the timings of each block to timings."""
+    for block_result, block_timings in block_results:
+        timings.merge(block_timings)
+        yield block_result
+
+
+def sim_iterate_pairs(sp_data_mod, pairs, xmin, xmax, ymin, ymax, 
+                      ybound_list, base_seed, config, workers=None, 
+                      raw_clusters=None, checkpoint=None, timings=None, 
+                      histograms=None):
+    """This is the main function that runs simulations of cellular location.
+    Every simulated layout is clustered for all (celltype1, celltype2) pairs 
+    in pairs at once.  Output is a SimStats of the runs, whose mean holds 
+    the average clustering values of each pair; pass the real data's 
+    clustering values of each pair as raw_clusters to get p-values too.  
+    config.sim_run_num runs are made, unless config.sim_tolerance is set, in 
+    which case the runs stop as soon as SimStats.converged allows 
+    (sim_run_num is then the most runs made).  With more than one worker 
+    (config.sim_workers, unless workers is given) the runs are shared out 
+    over a pool of processes; the results are still added up, and the 
+    stopping point decided, in run order, so the output is the same for any 
+    number of workers.  The workers memory-map the cells (and the cell pairs 
+    of the labels null model) from temporary files rather than each being 
+    sent a copy.  If a checkpoint path is given, the runs carry on 
+    from the checkpoint saved there (if it has the same base seed), and a 
+    new one is saved every config.checkpoint_every runs and at the end; the 
+    output is the same as if the runs had never been interrupted.  If a 
+    histogram store (see histogram.HistogramStore) is given as histograms, 
+    the runs it holds are used instead of being made again, and the runs 
+    made are added to it.  With config.null_model "labels", the runs are 
+    randomly labelled rather than positional; the cell pairs within range 
+    are then found once, before the first run.  Each step of the runs is 
+    timed in timings, summed over the workers."""
+    sim_run_num = config.sim_run_num
+    if timings is None:
+        timings = Timings()
+    saved = None
+    if checkpoint is not None:
+        saved = load_checkpoint(checkpoint, base_seed)
+    if saved is not None:
+        sim_stats = saved[1]
+    else:
+        sim_stats = SimStats((len(pairs), config.bins), raw_clusters, 
+                             config.sim_quantiles)
+    first_run = sim_run_num if sim_stats.converged(config) else sim_stats.count
+    neighbors = None
+    if config.null_model == "labels" and first_run < sim_run_num:
+        types = sorted(set(celltype for pair in pairs for celltype in pair))
+        with timings.stage("neighbor_pairs"):
+            neighbors = neighbor_pairs(sp_data_mod, types, config, timings)
+    if histograms is None:
+        sim_args = (sp_data_mod, pairs, xmin, xmax, ymin, ymax, ybound_list, 
+                    base_seed, config, None, neighbors)
+        first_new = first_run
+    else:
+        # New runs are made with the store's settings and start where the 
+        # stored runs end.
+        sim_args = (sp_data_mod, pairs, xmin, xmax, ymin, ymax, ybound_list, 
+                    base_seed, histograms.config, histograms.types, None)
+        first_new = histograms.runs
+    if workers is None:
+        workers = config.sim_workers
+    workers = workers or multiprocessing.cpu_count()
+    # Runs are generated in blocks of up to about 4 million coordinates, and 
+    # the blocks are shared out so that each worker gets several of them.  
+    # When the runs may stop early, blocks are kept small enough that 
+    # little work is wasted past the stopping point.
+    block = max(1, min(2 ** 22 // max(1, len(sp_data_mod)), 
+                       -(-sim_run_num // (workers * 4))))
+    if config.sim_tolerance is not None:
+        block = min(block, max(1, -(-config.sim_min_runs // workers)))
+    blocks = [list(range(start, min(start + block, sim_run_num))) 
+              for start in range(first_new, sim_run_num, block)]
+    shared = SharedFiles()
+    if workers == 1 or not blocks:
+        pool = None
+        block_results = (sim_block(sim_args, runcounts, timings) 
+                         for runcounts in blocks)
+    else:
+        with timings.stage("publish"):
+            published = shared.publish(sim_args)
+        pool = worker_pool(workers, sim_worker_init, (published,))
+        block_results = merge_timings(pool.imap(sim_worker_run, blocks), 
+                                      timings)
+    sim_clusters = itertools.chain.from_iterable(block_results)
+    if histograms is not None:
+        sim_clusters = histograms.sim_curves(first_run, sim_clusters, pairs, 
+                                             config)
+    try:
+        for sim_cluster in sim_clusters:
+            with timings.stage("sim_stats"):
+                sim_stats.add(sim_cluster)
+            if sim_stats.converged(config):
+                break
+            if (checkpoint is not None and 
+                    sim_stats.count % config.checkpoint_every == 0):
+                with timings.stage("checkpoint"):
+                    save_checkpoint(checkpoint, base_seed, sim_stats)
+        if checkpoint is not None:
+            with timings.stage("checkpoint"):
+                save_checkpoint(checkpoint, base_seed, sim_stats)
+    finally:
+        if pool is not None:
+            pool.terminate()
+            pool.join()
+        shared.close()
+    return sim_stats
+
@@ -0,0 +1,192 @@
+"""Running statistics of the simulation runs, kept up to date as each run 
+comes in so that no run has to be stored."""
+from __future__ import absolute_import, division
+
+import numpy as np
+
+
+class QuantileSketch(object):
+    """Running estimate of one quantile of every bin.  The first exact_runs 
+    runs are kept, and the quantile is found from them exactly.  After 
+    that, the estimate carries on with the P-square algorithm (Jain and 
+    Chlamtac, 1985), started from the kept runs: each bin keeps 5 markers 
+    whose heights track the minimum, the quantile, the maximum and two 
+    points between, so the memory used does not grow with the number of 
+    runs.  P-square is poor in the tails with few runs, which is why it is 
+    not used until there are exact_runs of them.  prob is the quantile 
+    wanted, between 0 and 1; exact_runs must be at least 5."""
+
+    def __init__(self, prob, shape, exact_runs=100):
+        self.prob = prob
+        self.count = 0
+        self.exact_runs = exact_runs
+        self.runs = np.zeros((exact_runs,) + tuple(shape))
+        self.heights = np.zeros((5,) + tuple(shape))
+        self.positions = np.zeros((5,) + tuple(shape))
+        self.increments = np.array([0., prob / 2, prob, (1 + prob) / 2, 1.])
+        self.desired = None
+
+    def add(self, value):
+        """Add the values of one run."""
+        self.count += 1
+        if self.count <= self.exact_runs:
+            self.runs[self.count - 1] = value
+            return
+        if self.runs is not None:
+            self.start_markers()
+        heights, positions = self.heights, self.positions
+        # Every marker above the new value moves up one place
+        positions[1:4] += value < heights[1:4]
+        positions[4] += 1
+        heights[0] = np.minimum(heights[0], value)
+        heights[4] = np.maximum(heights[4], value)
+        self.desired += self.increments
+        for i in (1, 2, 3):
+            offset = self.desired[i] - positions[i]
+            below = positions[i - 1] - positions[i]
+            above = positions[i + 1] - positions[i]
+            step = (((offset >= 1) & (above > 1)).astype(float) - 
+                    ((offset <= -1) & (below < -1)))
+            if not step.any():
+                continue
+            parabolic = heights[i] + step / (above - below) * (
+                (step - below) * (heights[i + 1] - heights[i]) / above + 
+                (above - step) * (heights[i] - heights[i - 1]) / -below)
+            linear = heights[i] + step * (
+                np.where(step > 0, heights[i + 1] - heights[i], 
+                         heights[i - 1] - heights[i]) / 
+                np.where(step > 0, above, below))
+            moved = np.where((heights[i - 1] < parabolic) & 
+                             (parabolic < heights[i + 1]), parabolic, linear)
+            heights[i] = np.where(step != 0, moved, heights[i])
+            positions[i] += step
+
+    def start_markers(self):
+        """Set the 5 markers from the kept runs, at the places P-square 
+        would want them after that many runs, and let the runs go.  The 
+        marker heights are interpolated between the runs, as np.percentile 
+        does, so the estimate carries on smoothly from the exact one."""
+        self.desired = (self.exact_runs - 1) * self.increments
+        self.heights[:] = np.percentile(
+            self.runs, 100 * self.desired / (self.exact_runs - 1), axis=0)
+        self.positions[:] = self.desired.reshape(
+            (5,) + (1,) * (self.runs.ndim - 1))
+        self.runs = None
+
+    @property
+    def estimate(self):
+        """Current estimate of the quantile of each bin.  Up to exact_runs 
+        runs it is found from the runs themselves."""
+        if self.count <= self.exact_runs:
+            return np.percentile(self.runs[:self.count], 
+                                 100 * self.prob, axis=0)
+        return self.heights[2].copy()
+
+
+class SimStats(object):
+    """Per-bin statistics of the simulation runs of one or more cell type 
+    pairs.  total is the sum of all runs, from which the mean clustering 
+    values are taken; welford_mean and sq_dev are Welford's running mean 
+    and sum of squared deviations, from which their standard error is 
+    taken.  low and high are the envelope of the runs, and sketches hold a 
+    QuantileSketch for each probability in quantiles.  If the real data's 
+    clustering values are given as raw_cluster, the runs at or above them 
+    and at or below them are counted for the Monte Carlo p-values.  Every 
+    array has the shape given, usually (pairs, bins)."""
+
+    def __init__(self, shape, raw_cluster=None, quantiles=()):
+        self.count = 0
+        self.total = np.zeros(shape)
+        self.welford_mean = np.zeros(shape)
+        self.sq_dev = np.zeros(shape)
+        self.low = np.full(shape, np.inf)
+        self.high = np.full(shape, -np.inf)
+        self.sketches = [QuantileSketch(prob, shape) for prob in quantiles]
+        self.raw_cluster = raw_cluster
+        self.at_least_raw = np.zeros(shape, dtype=np.int64)
+        self.at_most_raw = np.zeros(shape, dtype=np.int64)
+
+    def add(self, sim_cluster):
+        """Add the clustering values of one simulation run."""
+        self.count += 1
+        self.total += sim_cluster
+        delta = sim_cluster - self.welford_mean
+        self.welford_mean += delta / self.count
+        self.sq_dev += delta * (sim_cluster - self.welford_mean)
+        np.minimum(self.low, sim_cluster, out=self.low)
+        np.maximum(self.high, sim_cluster, out=self.high)
+        for sketch in self.sketches:
+            sketch.add(sim_cluster)
+        if self.raw_cluster is not None:
+            self.at_least_raw += sim_cluster >= self.raw_cluster
+            self.at_most_raw += sim_cluster <= self.raw_cluster
+
+    @property
+    def mean(self):
+        """Average clustering values of the runs so far."""
+        return self.total / self.count
+
+    def relative_error(self):
+        """Standard error of the mean clustering value of each bin, as a 
+        fraction of that mean.  Since the raw clustering values are fixed, 
+        this is also the relative standard error of the corrected ratio.  
+        Bins with no simulated pairs are 0; every bin is infinite until 
+        there are 2 runs."""
+        if self.count < 2:
+            return np.full(self.total.shape, np.inf)
+        std_error = np.sqrt(self.sq_dev / (self.count - 1) / self.count)
+        error = np.zeros(self.total.shape)
+        nonzero = self.welford_mean != 0
+        error[nonzero] = (std_error[nonzero] / 
+                          np.abs(self.welford_mean[nonzero]))
+        return error
+
+    def envelope(self):
+        """Smallest and largest clustering value of each bin over the runs, 
+        stacked along a new first axis."""
+        return np.array([self.low, self.high])
+
+    def quantiles(self):
+        """Estimated quantiles of each bin, stacked along a new first axis 
+        in the order of the quantiles given."""
+        return np.array([sketch.estimate for sketch in self.sketches]).reshape(
+            (len(self.sketches),) + self.total.shape)
+
+    def p_values(self):
+        """Rank-based Monte Carlo p-values of the real clustering values in 
+        each bin, (1 + runs as extreme) / (1 + runs): first that the cells 
+        are at least as clustered as the null model's, then that they are 
+        at least as dispersed.  Both are stacked along a new first axis."""
+        return np.array([(1 + self.at_least_raw) / (1 + self.count), 
+                         (1 + self.at_most_raw) / (1 + self.count)])
+
+    def tested_bins(self, config):
+        """Mask of the bins the early stopping test of converged uses.  The 
+        shortest distances have only a few simulated cell pairs, and a bin 
+        whose mean is m pairs has a relative standard error of about 
+        1 / sqrt(m * runs) from counting alone, so bins with a mean below 
+        1 / (config.sim_tolerance ** 2 * config.sim_run_num) could not get 
+        within the tolerance in the runs allowed, and are left out; 
+        config.sim_tolerance_min_count, if set, is used as that lower limit 
+        instead.  Without a tolerance, every bin with simulated pairs is 
+        tested."""
+        mean = np.abs(self.welford_mean)
+        if config.sim_tolerance is None:
+            return mean > 0
+        min_count = config.sim_tolerance_min_count
+        if min_count is None:
+            min_count = 1 / (config.sim_tolerance ** 2 * config.sim_run_num)
+        return (mean > 0) & (mean >= min_count)
+
+    def converged(self, config):
+        """Whether early stopping (config.sim_tolerance) allows the runs to 
+        end here: there are at least config.sim_min_runs runs, and the 
+        relative standard error of every bin of tested_bins is within the 
+        tolerance.  While no bin is tested, the runs carry on."""
+        if (config.sim_tolerance is None or 
+                self.count < config.sim_min_runs):
+            return False
+        tested = self.tested_bins(config)
+        return bool(np.any(tested) and 
+                    np.all(self.relative_error()[tested] <= 
+                           config.sim_tolerance))
@@ -0,0 +1,75 @@
+"""Timing of the stages of an analysis, and counts of the work done in 
+them, for sizing jobs and spotting slowdowns."""
+from __future__ import absolute_import, division
+
+import contextlib
+import json
+import time
+
+
+class Timings(object):
+    """Wall-clock time and number of calls of each named stage of an 
+    analysis, with counts of the work done in each (such as the number of 
+    pair distances measured).  Pass one Timings to the analysis functions 
+    to collect them; those that get None use a Timings of their own that is 
+    thrown away.  Stages run in worker processes are timed there and added 
+    in with merge, so their seconds are summed over the workers."""
+
+    def __init__(self):
+        self.stages = {}
+        self.active = []
+        self.started = time.time()
+
+    def record(self, name):
+        """The {"seconds", "calls", "counts"} record of a stage."""
+        return self.stages.setdefault(name, {"seconds": 0., "calls": 0, 
+                                             "counts": {}})
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        """Time the code in a with block as one call of stage name."""
+        record = self.record(name)
+        self.active.append(name)
+        start = time.time()
+        try:
+            yield
+        finally:
+            record["seconds"] += time.time() - start
+            record["calls"] += 1
+            self.active.pop()
+
+    def count(self, name, number):
+        """Add number to the count name of the innermost running stage."""
+        counts = self.record(self.active[-1] if self.active else 
+                             "other")["counts"]
+        counts[name] = counts.get(name, 0) + int(number)
+
+    def merge(self, other):
+        """Add the stages of another Timings, such as one sent back by a 
+        worker process, to these."""
+        for name, other_record in other.stages.items():
+            record = self.record(name)
+            record["seconds"] += other_record["seconds"]
+            record["calls"] += other_record["calls"]
+            for count_name, number in other_record["counts"].items():
+                record["counts"][count_name] = (
+                    record["counts"].get(count_name, 0) + number)
+
+    def report(self, config=None):
+        """The timings as a dict that can be saved as JSON: the wall-clock 
+        time since this Timings was made, each stage's record, and the 
+        settings in config if given."""
+        report = {"wall_seconds": time.time() - self.started, 
+                  "stages": self.stages}
+        if config is not None:
+            report["config"] = dict((name, getattr(config, name)) 
+                                    for name, value in config.defaults)
+        return report
+
+    def save(self, path, config=None, **info):
+        """Save report(config) as a JSON file, with any extra items in 
+        info (such as the data file and number of cells)."""
+        report = self.report(config)
+        report.update(info)
+        with open(path, "w") as report_file:
+            json.dump(report, report_file, indent=2, sort_keys=True)